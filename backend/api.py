@@ -1,10 +1,11 @@
 import os
 import os.path as op
 import json
+import hmac
+import asyncio
 from stripe.api_resources import payment_intent
 import yaml
-from glob import glob
-from typing import Optional
+from typing import Optional, List
 from dotenv import load_dotenv
 import sendgrid  # sendgrid API
 from sendgrid.helpers.mail import *
@@ -28,14 +29,13 @@ STRIPE_API_KEY = os.environ.get("STRIPE_SECRET_KEY")
 if STRIPE_API_KEY:
     stripe.api_key = STRIPE_API_KEY
 
-import joblib
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
 import pandas as pd
 from pydantic import BaseModel
-from pyairtable import Table
 import utils  # import utils as a library, make sure to load environment variables before
 from utils import get_user_info, get_data, set_data, update_data, get_agenda
+from utils import run_blocking
 
 from fastapi import FastAPI, Query, Header, status
 from fastapi.encoders import jsonable_encoder
@@ -59,19 +59,14 @@ user_collection = collections["users"]
 preference_collection = collections["preferences"]
 
 es = Elasticsearch([{"host": es_config["host"], "port": es_config["port"]}])
-
-# loading model and embeddings
-model_paths = glob("../sitedata/embeddings/*.joblib")
-embedding_paths = glob("../sitedata/embeddings/*.json")
-if len(model_paths) > 0:
-    nbrs_models = {
-        op.basename(path).split(".")[0]: joblib.load(path) for path in model_paths
-    }
-if len(embedding_paths) > 0:
-    embeddings = {
-        op.basename(path).split(".")[0]: json.load(open(path, "r"))
-        for path in embedding_paths
-    }
+# optional write-behind store for votes, None if votes go to Firestore directly
+preference_store = utils.load_preference_store(preference_collection)
+
+# memory-mapped embedding matrices of the current version, reloaded without
+# restart when scripts/embeddings.py publishes a new one
+embedding_registry = utils.EmbeddingRegistry("../sitedata/embeddings")
+EMBEDDING_RELOAD_INTERVAL = float(os.environ.get("EMBEDDING_RELOAD_INTERVAL", 30))
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
 airtable_key = os.environ.get("AIRTABLE_KEY")
 # map between "edition" and "filter_accepted", default as False
 FILTER_ACCEPTED = {
@@ -94,6 +89,67 @@ app.add_middleware(
 HTTP_REQUEST = Request()
 
 
+def read_user_preference(user_id: str):
+    """Get preference of a user including votes not yet flushed to Firestore"""
+    if preference_store is not None:
+        return preference_store.get_preference(user_id)
+    return get_data(user_id, preference_collection)
+
+
+def write_user_votes(user_id: str, edition: str, operations: list):
+    """
+    Write votes of a user, operations is a list of (submission_id, action)
+    with at most one operation per submission
+    """
+    if preference_store is not None:
+        preference_store.record(user_id, edition, operations)
+    else:
+        like_ids = [s for s, a in operations if a == "like"]
+        dislike_ids = [s for s, a in operations if a == "dislike"]
+        utils.update_array(
+            like_ids, dislike_ids, user_id, preference_collection, edition
+        )
+
+
+async def flush_preference_store():
+    """Periodically flush the write-behind preference store to Firestore"""
+    while True:
+        await asyncio.sleep(preference_store.flush_interval)
+        try:
+            await run_blocking(preference_store.flush)
+        except Exception as e:
+            print(f"Failed to flush preference store: {e}")
+
+
+@app.on_event("startup")
+async def start_preference_flush():
+    if preference_store is not None:
+        asyncio.create_task(flush_preference_store())
+
+
+@app.on_event("shutdown")
+async def stop_preference_flush():
+    if preference_store is not None:
+        await run_blocking(preference_store.flush)
+
+
+async def watch_embeddings():
+    """Swap in new embeddings as soon as a new version is published"""
+    while True:
+        await asyncio.sleep(EMBEDDING_RELOAD_INTERVAL)
+        try:
+            if await run_blocking(embedding_registry.reload):
+                print(f"Loaded embeddings {embedding_registry.snapshot.version}")
+        except Exception as e:
+            print(f"Failed to reload embeddings: {e}")
+
+
+@app.on_event("startup")
+async def start_embedding_watch():
+    if EMBEDDING_RELOAD_INTERVAL > 0:
+        asyncio.create_task(watch_embeddings())
+
+
 class Submission(BaseModel):
     # fields provided by users
     title: str = ""
@@ -119,6 +175,15 @@ class Vote(BaseModel):
     action: str = None
 
 
+class VoteOperation(BaseModel):
+    submission_id: str
+    action: str
+
+
+class VoteBatch(BaseModel):
+    operations: List[VoteOperation] = []
+
+
 class PaymentPayload(BaseModel):
     currency: str = "USD"
     amount: int = 1500
@@ -134,7 +199,7 @@ async def get_affiliations(
     if n_results is None:
         n_results = 10
     if q is not None:
-        queries = utils.query_affiliations(q, n_results=n_results)
+        queries = await run_blocking(utils.query_affiliations, q, n_results=n_results)
     else:
         queries = []
     return JSONResponse(content={"data": queries})
@@ -153,7 +218,7 @@ async def send_confirmation_email(
         Add more email template on sitedata/email-content.json
     """
     if SENDGRID_API:
-        user_info = get_user_info(authorization)
+        user_info = await run_blocking(get_user_info, authorization)
         email = user_info.get("email")
         sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API)
 
@@ -161,7 +226,7 @@ async def send_confirmation_email(
         data = email_content.get(email_type)
         for d in data["personalizations"]:
             d.update({"to": [{"email": email}]})
-        response = sg.client.mail.send.post(request_body=data)
+        response = await run_blocking(sg.client.mail.send.post, request_body=data)
         return JSONResponse(status_code=response.status_code)
     else:
         return None
@@ -179,10 +244,10 @@ async def get_user(authorization: Optional[str] = Header(None)):
     From a given authorization, get user ID, and
     get user data from Firebase
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
         user_id = user_info.get("user_id")
-        user = get_data(user_id, user_collection)
+        user = await run_blocking(get_data, user_id, user_collection)
         if user is not None:
             return JSONResponse(content={"data": user})
         else:
@@ -200,10 +265,12 @@ async def create_user(
     Structure of the user data from front-end is as follows
         {"id": ..., "payload": ...}
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
         user_id = user_info.get("user_id")
-        set_data(user_data["payload"], user_id, user_collection)  # set data
+        await run_blocking(
+            set_data, user_data["payload"], user_id, user_collection
+        )  # set data
         print(f"Done setting user with ID = {user_id}")
     else:
         return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -216,10 +283,12 @@ async def update_user(
     """
     Update user on Firebase collection for a given user data.
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
         user_id = user_info.get("user_id")
-        update_data(user_data["payload"], user_id, user_collection)  # update data
+        await run_blocking(
+            update_data, user_data["payload"], user_id, user_collection
+        )  # update data
         print(f"Done setting user with ID = {user_id}")
     else:
         return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -230,10 +299,12 @@ async def get_user_votes(authorization: Optional[str] = Header(None)):
     """
     Get user votes for all conference editions.
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
         user_id = user_info.get("user_id")
-        user_preference = get_data(user_id, preference_collection)  # all preferences
+        user_preference = await run_blocking(
+            read_user_preference, user_id
+        )  # all preferences
         if user_preference is None:
             user_preference = []
         return JSONResponse(content={"data": user_preference})
@@ -246,10 +317,12 @@ async def get_user_votes(edition: str, authorization: Optional[str] = Header(Non
     """
     Get user votes from a specific edition.
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
         user_id = user_info.get("user_id")
-        user_preference = get_data(user_id, preference_collection)  # all preferences
+        user_preference = await run_blocking(
+            read_user_preference, user_id
+        )  # all preferences
 
         if user_preference is not None:
             ids = user_preference.get(edition, [])
@@ -278,45 +351,150 @@ async def update_user_votes(
     submission_id: str
     action: Vote, string can be "like" or "dislike"
     """
-    # TODOs: set preference on Firebase
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is None:
         return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED)
     user_id = user_info.get("user_id")
-    user_preference = get_data(user_id, preference_collection)  # all preferences
 
     action = action.dict()["action"]
 
-    if action == "like" and user_id is not None:
-        if user_preference is None:
-            user_preference = {edition: [submission_id]}
-            try:
-                set_data(user_preference, user_id, preference_collection)
-            except (google.cloud.exceptions.NotFound, TypeError):
-                return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
-        else:
-            current_pref = user_preference.get(edition, [])
-            update_pref = list(set([*current_pref, submission_id]))
-            if len(update_pref) > 0:
-                try:
-                    update_data({edition: update_pref}, user_id, preference_collection)
-                except (google.cloud.exceptions.NotFound, TypeError):
-                    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
-            else:
-                pass
-    elif action == "dislike" and user_id is not None:
-        if user_preference is None:
-            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
-        else:
-            current_pref = user_preference.get(edition, [])
-            update_pref = list(set(current_pref) - set([submission_id]))
-            user_preference.update({edition: update_pref})
-            try:
-                update_data(user_preference, user_id, preference_collection)
-            except (google.cloud.exceptions.NotFound, TypeError):
-                return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
-    else:
+    # one atomic array transform per vote, concurrent votes do not overwrite
+    if action not in ("like", "dislike") or user_id is None:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
+    try:
+        await run_blocking(
+            write_user_votes, user_id, edition, [(submission_id, action)]
+        )
+    except (google.cloud.exceptions.NotFound, TypeError):
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
+    # votes changed, drop cached recommendations of this user
+    utils.invalidate_recommendations(user_id, f"agenda-{edition}")
+
+
+@app.patch("/api/user/preference/{edition}")
+async def update_user_votes_batch(
+    edition: str,
+    votes: VoteBatch,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Update a batch of votes made by user in an abstract browser to Firebase
+    in one batched write, the last action on each submission wins
+
+    edition: str
+    votes: VoteBatch, list of operations {"submission_id": ..., "action": ...}
+        where action can be "like" or "dislike"
+    """
+    user_info = await run_blocking(get_user_info, authorization)
+    if user_info is None:
+        return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED)
+    user_id = user_info.get("user_id")
+    if user_id is None:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
+
+    actions = {}  # coalesce operations, dict keeps the order of first vote
+    for operation in votes.operations:
+        if operation.action not in ("like", "dislike"):
+            return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
+        actions[operation.submission_id] = operation.action
+    if len(actions) == 0:
+        return JSONResponse(content={"data": {"like": 0, "dislike": 0}})
+    operations = list(actions.items())
+    try:
+        await run_blocking(write_user_votes, user_id, edition, operations)
+    except (google.cloud.exceptions.NotFound, TypeError):
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
+    # votes changed, drop cached recommendations of this user
+    utils.invalidate_recommendations(user_id, f"agenda-{edition}")
+    n_like = sum(a == "like" for _, a in operations)
+    return JSONResponse(
+        content={"data": {"like": n_like, "dislike": len(operations) - n_like}}
+    )
+
+
+def is_admin(x_admin_key: Optional[str] = None) -> bool:
+    """
+    Check the X-Admin-Key header against ``ADMIN_API_KEY`` in constant time,
+    admin endpoints are disabled if ``ADMIN_API_KEY`` is not set
+    """
+    if ADMIN_API_KEY is None:
+        return False
+    return hmac.compare_digest(x_admin_key or "", ADMIN_API_KEY)
+
+
+@app.get("/api/metrics/preference")
+async def get_preference_metrics(x_admin_key: Optional[str] = Header(None)):
+    """
+    Metrics of the write-behind preference store such as the number of
+    pending votes and the flush lag in seconds, empty if it is disabled.
+    Requires the X-Admin-Key header.
+    """
+    if not is_admin(x_admin_key):
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN)
+    if preference_store is None:
+        return JSONResponse(content={"data": {}})
+    stats = await run_blocking(preference_store.stats)
+    return JSONResponse(content={"data": stats})
+
+
+@app.get("/api/metrics/embeddings")
+async def get_embedding_metrics(x_admin_key: Optional[str] = Header(None)):
+    """
+    Version of embeddings served by this worker and number of reloads.
+    Requires the X-Admin-Key header.
+    """
+    if not is_admin(x_admin_key):
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN)
+    return JSONResponse(content={"data": embedding_registry.stats()})
+
+
+@app.post("/api/admin/embeddings/reload")
+async def reload_embeddings(
+    force: bool = Query(False), x_admin_key: Optional[str] = Header(None)
+):
+    """
+    Reload embeddings in this worker now instead of waiting for the watcher,
+    other workers pick up the new version within ``EMBEDDING_RELOAD_INTERVAL``.
+    Requires ``ADMIN_API_KEY`` in the environment and as X-Admin-Key header.
+
+    force: bool, if True, reload even if the version did not change
+        and accept a version that drops editions
+    """
+    if not is_admin(x_admin_key):
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        reloaded = await run_blocking(embedding_registry.reload, force)
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"message": f"Failed to reload embeddings: {e}"},
+        )
+    return JSONResponse(
+        content={"data": {"reloaded": reloaded, **embedding_registry.stats()}}
+    )
+
+
+@app.get("/api/metrics/cache")
+async def get_cache_metrics(x_admin_key: Optional[str] = Header(None)):
+    """
+    Size and hit rate of in-process caches of this worker.
+    Requires the X-Admin-Key header.
+    """
+    if not is_admin(x_admin_key):
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN)
+    return JSONResponse(
+        content={
+            "data": {
+                "firestore": utils.document_cache.stats(),
+                "token": utils.token_cache.stats(),
+                "recommendation": utils.recommendation_cache.stats(),
+                "abstract": {
+                    index: cache.stats()
+                    for index, cache in utils.abstract_caches.items()
+                },
+            }
+        }
+    )
 
 
 def query_params_builder(
@@ -379,7 +557,9 @@ async def get_agenda(edition: str, starttime: Optional[str] = None):
         2020-10-26 10:00:00, 2020-10-26 10:00:00+00:00
     """
     if starttime is not None:
-        abstracts = utils.get_agenda(index=f"agenda-{edition}", starttime=starttime)
+        abstracts = await run_blocking(
+            utils.get_agenda, index=f"agenda-{edition}", starttime=starttime
+        )
     else:
         abstracts = []
 
@@ -394,8 +574,11 @@ async def get_abstracts(
     view: Optional[str] = Query("default"),
     starttime: Optional[str] = Query(None),
     endtime: Optional[str] = Query(None),
+    sort: Optional[str] = Query(None),
     skip: int = Query(0),
     limit: int = Query(40),
+    paginate: Optional[str] = Query("offset"),
+    cursor: Optional[str] = Query(None),
     authorization: Optional[str] = Header(None),
 ):
     """
@@ -406,52 +589,83 @@ async def get_abstracts(
     view: Optional[str], can be "default" | "your-votes" | "recommendations" | "personalized"
     starttime: str, starttime parameter
     endtime: str, endtime parameter
+    sort: str, sort parameter for default view, "starttime" | "-starttime" | "relevance"
     skip: int = 0, skip parameter
     limit: int = 40, limit parameter
+    paginate: str, "offset" (skip and limit) or "cursor" (default view only)
+    cursor: str, opaque cursor from links.next of the previous page in cursor mode
     """
-    # get preference from Firebase
-    try:
-        user_info = get_user_info(authorization)
-        user_id = user_info.get("user_id")
-        user_preference = get_data(user_id, preference_collection).get(
-            edition, []
-        )  # all preferences
-    except:
-        user_preference = []
-
-    es_search = Search(using=es, index=f"agenda-{edition}")
-    n_submissions = es_search.count()
     page_size = limit  # set page size to equal to limit
     current_page = int(skip / page_size) + 1
-    n_page = int(n_submissions / page_size) + 1
+    # finish the request on these embeddings even if a new version is swapped in
+    snapshot = embedding_registry.snapshot
+    if view in ["recommendations", "personalized"] and (
+        f"agenda-{edition}" not in snapshot.embeddings
+    ):
+        # no embeddings for this edition, see scripts/embeddings.py
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND)
 
-    if current_page > n_page:
+    if view == "default" and (paginate == "cursor" or cursor is not None):
+        # search_after with point-in-time, no count and no deep from/size
+        submissions, next_cursor, n_submissions = await run_blocking(
+            utils.search_abstracts_after,
+            q,
+            index=f"agenda-{edition}",
+            starttime=starttime,
+            endtime=endtime,
+            sort=sort,
+            cursor=cursor,
+            limit=limit,
+        )
+        params = [
+            ("view", view),
+            ("q", q),
+            ("starttime", starttime),
+            ("endtime", endtime),
+            ("sort", sort),
+            ("limit", page_size),
+            ("paginate", "cursor"),
+        ]
         return JSONResponse(
             content={
                 "meta": {
-                    "currentPage": current_page,
-                    "totalPage": n_page,
                     "pageSize": page_size,
+                    "total": n_submissions,
+                    "hasNextPage": next_cursor is not None,
                 },
-                "data": [],
+                "links": {
+                    "current": query_params_builder()(
+                        f"/api/abstract/{edition}", [*params, ("cursor", cursor)]
+                    ),
+                    "next": query_params_builder()(
+                        f"/api/abstract/{edition}", [*params, ("cursor", next_cursor)]
+                    )
+                    if next_cursor is not None
+                    else None,
+                },
+                "data": submissions,
             }
         )
-
-    if view == "default":
-        submissions = utils.query_abstracts(
-            q, index=f"agenda-{edition}"
-        )  # get all responses
-        submissions = utils.filter_startend_time(
-            submissions, starttime, endtime
-        )  # filter by start, end time
-        if q == "" or q is None:
-            submissions = sorted(submissions, key=lambda x: x["starttime"])
+    elif view == "default":
+        # search, filter, sort and paginate in a single ElasticSearch request
+        submissions, n_submissions = await run_blocking(
+            utils.search_abstracts,
+            q,
+            index=f"agenda-{edition}",
+            starttime=starttime,
+            endtime=endtime,
+            sort=sort,
+            skip=skip,
+            limit=limit,
+        )
+        n_page = int(n_submissions / page_size) + 1
         return JSONResponse(
             content={
                 "meta": {
                     "currentPage": current_page,
-                    "totalPage": int(len(submissions) / page_size) + 1,
+                    "totalPage": n_page,
                     "pageSize": page_size,
+                    "total": n_submissions,
                 },
                 "links": {
                     "current": query_params_builder()(
@@ -461,6 +675,7 @@ async def get_abstracts(
                             ("q", q),
                             ("starttime", starttime),
                             ("endtime", endtime),
+                            ("sort", sort),
                             ("skip", skip),
                             ("limit", page_size),
                         ],
@@ -472,27 +687,62 @@ async def get_abstracts(
                             ("q", q),
                             ("starttime", starttime),
                             ("endtime", endtime),
+                            ("sort", sort),
                             ("skip", skip + page_size),
                             ("limit", page_size),
                         ],
                     ),
                 },
-                "data": submissions[skip : skip + limit],
+                "data": submissions,
             }
         )
-    elif view == "your-votes":
-        # Get preference from Firebase and return to frontend
+
+    async def get_preference():
+        # get preference from Firebase
+        user_info = await run_blocking(get_user_info, authorization)
+        user_id = user_info.get("user_id")
+        user_preference = await run_blocking(read_user_preference, user_id)
+        return user_id, user_preference.get(edition, [])
+
+    # fetch preference and count in parallel, they are independent
+    es_search = Search(using=es, index=f"agenda-{edition}")
+    preference, n_submissions = await asyncio.gather(
+        get_preference(), run_blocking(es_search.count), return_exceptions=True
+    )
+    if isinstance(n_submissions, Exception):
+        raise n_submissions
+    if isinstance(preference, Exception):
+        user_id, user_preference = None, []
+    else:
+        user_id, user_preference = preference
+    n_page = int(n_submissions / page_size) + 1
+
+    if current_page > n_page:
+        return JSONResponse(
+            content={
+                "meta": {
+                    "currentPage": current_page,
+                    "totalPage": n_page,
+                    "pageSize": page_size,
+                },
+                "data": [],
+            }
+        )
+
+    if view == "your-votes":
+        # Get preference from Firebase, paginate and fetch only one page in one mget
         submission_ids = user_preference
-        submissions = []
-        for idx in submission_ids:
-            submission = utils.get_abstract(index=f"agenda-{edition}", id=idx)
-            if submission is not None:
-                submissions.append(submission)
+        n_page = int(len(submission_ids) / page_size) + 1
+        submissions = await run_blocking(
+            utils.get_abstracts,
+            index=f"agenda-{edition}",
+            ids=submission_ids[skip : skip + limit],
+        )
         return JSONResponse(
             content={
                 "meta": {
                     "currentPage": int(skip / page_size) + 1,
-                    "totalPage": int(len(submissions) / page_size) + 1,
+                    "totalPage": n_page,
                     "pageSize": page_size,
                 },
                 "links": {
@@ -513,31 +763,40 @@ async def get_abstracts(
                         ],
                     ),
                 },
-                "data": submissions[skip : skip + limit]
-                if len(submissions) > 0
-                else [],
+                "data": submissions,
             }
         )
     elif view == "recommendations":
         # TODOs: get votes for generating recommendations
         submission_ids = user_preference
         try:
-            submissions = utils.generate_recommendations(
+            # rank the top (skip + limit) from cache, fetch only the current page
+            recommend_ids, n_recommend = await run_blocking(
+                utils.get_recommendation_ids,
                 submission_ids,
-                data=embeddings,
+                data=snapshot.embeddings,
                 index=f"agenda-{edition}",
-                nbrs_model=nbrs_models[f"agenda-{edition}"],
+                k=skip + limit,
                 exploration=False,
-                abstract_info=True,
+                starttime=starttime,
+                endtime=endtime,
+                user_id=user_id,
+                generation=snapshot.generation,
             )
-        except:
-            submissions = []
-        submissions = utils.filter_startend_time(submissions, starttime, endtime)
+        except Exception as e:
+            print(f"Failed to recommend abstracts of edition {edition}: {e}")
+            recommend_ids, n_recommend = [], 0
+        n_page = int(n_recommend / page_size) + 1
+        submissions = await run_blocking(
+            utils.get_abstracts,
+            index=f"agenda-{edition}",
+            ids=recommend_ids[skip : skip + limit],
+        )
         return JSONResponse(
             content={
                 "meta": {
                     "currentPage": int(skip / page_size) + 1,
-                    "totalPage": int(len(submissions) / page_size) + 1,
+                    "totalPage": n_page,
                     "pageSize": page_size,
                 },
                 "links": {
@@ -562,26 +821,39 @@ async def get_abstracts(
                         ],
                     ),
                 },
-                "data": submissions[skip : skip + limit]
-                if len(submissions) > 0
-                else [],
+                "data": submissions,
             }
         )
     elif view == "personalized":
         # TODOs: get votes for generating personalized recommendation
         submission_ids = user_preference
-        submissions = utils.generate_personalized_recommendations(
-            submission_ids,
-            data=embeddings,
+        try:
+            # personalized agenda is computed on rows, fetch only the current page
+            personalized_ids, n_personalized = await run_blocking(
+                utils.get_recommendation_ids,
+                submission_ids,
+                data=snapshot.embeddings,
+                index=f"agenda-{edition}",
+                starttime=starttime,
+                endtime=endtime,
+                view="personalized",
+                user_id=user_id,
+                generation=snapshot.generation,
+            )
+        except Exception as e:
+            print(f"Failed to personalize abstracts of edition {edition}: {e}")
+            personalized_ids, n_personalized = [], 0
+        n_page = int(n_personalized / page_size) + 1
+        submissions = await run_blocking(
+            utils.get_abstracts,
             index=f"agenda-{edition}",
-            nbrs_model=nbrs_models[f"agenda-{edition}"],
+            ids=personalized_ids[skip : skip + limit],
         )
-        submissions = utils.filter_startend_time(submissions, starttime, endtime)
         return JSONResponse(
             content={
                 "meta": {
                     "currentPage": int(skip / page_size) + 1,
-                    "totalPage": int(len(submissions) / page_size) + 1,
+                    "totalPage": n_page,
                     "pageSize": page_size,
                 },
                 "links": {
@@ -606,9 +878,7 @@ async def get_abstracts(
                         ],
                     ),
                 },
-                "data": submissions[skip : skip + limit]
-                if len(submissions) > 0
-                else [],
+                "data": submissions,
             }
         )
     else:
@@ -654,13 +924,14 @@ async def get_abstract(edition: str, submission_id: str):
     table_name = es_config["editions"][edition].get("table_name")
     if base_id is None:
         # query from Elasticsearch
-        abstract = utils.get_abstract(index=f"agenda-{edition}", id=submission_id)
+        abstract = await run_blocking(
+            utils.get_abstract, index=f"agenda-{edition}", id=submission_id
+        )
     else:
-        # query from Airtable
-        table = Table(api_key=airtable_key, base_id=base_id, table_name=table_name)
-        abstract = table.get(submission_id).get(
-            "fields", {}
-        )  # return abstract from Airtable
+        # query from the local copy of Airtable
+        airtable_cache = utils.get_airtable_cache(airtable_key, base_id, table_name)
+        record = await run_blocking(airtable_cache.get, submission_id)
+        abstract = dict(record.get("fields", {})) if record is not None else {}
     # add missing fields
     abstract["edition"] = edition
     abstract["submission_id"] = submission_id
@@ -677,10 +948,10 @@ async def create_abstract(
     Submit an abstract to Airtable
     """
     submission = submission.dict()
-    user_info = get_user_info(authorization)
-    user_id = get_user_info(authorization).get("user_id")
+    user_info = await run_blocking(get_user_info, authorization)
+    user_id = user_info.get("user_id") if user_info is not None else None
     if user_id is not None:
-        user = get_data(user_id, user_collection)
+        user = await run_blocking(get_data, user_id, user_collection)
         submission["firstname"] = user.get("firstname", "")
         submission["lastname"] = user.get("lastname", "")
 
@@ -691,15 +962,18 @@ async def create_abstract(
         print("Seems like there is no Airtable set up, only a CSV file")
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
     else:
-        table = Table(api_key=airtable_key, base_id=base_id, table_name=table_name)
-        r = table.create(submission)  # create submission on Airtable
+        airtable_cache = utils.get_airtable_cache(airtable_key, base_id, table_name)
+        r = await run_blocking(
+            airtable_cache.table.create, submission
+        )  # create submission on Airtable
+        airtable_cache.put(r)
         print(f"Set the record {r['id']} on Airtable")
 
         # update submission_id to user on Firebase
         if user_info is not None:
             user_id = user_info.get("user_id")
-            update_data(
-                {"submission_id": r["id"]}, user_id, user_collection
+            await run_blocking(
+                update_data, {"submission_id": r["id"]}, user_id, user_collection
             )  # update submission id to a user on Firebase
             return JSONResponse(status_code=status.HTTP_200_OK)
         else:
@@ -718,12 +992,12 @@ async def update_abstract(
     """
     # only allow some keys to be updated by the presenter
     submission = submission.dict()
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     user_id = user_info.get("user_id")
     print("Usedr Info: ", user_info)
     print("User ID: ", user_id)
     if user_id is not None:
-        user = get_data(user_id, user_collection)
+        user = await run_blocking(get_data, user_id, user_collection)
         print(user)
         submission["firstname"] = user.get("firstname", "")
         submission["lastname"] = user.get("lastname", "")
@@ -753,8 +1027,11 @@ async def update_abstract(
         print("Seems like there is no Airtable set up, only a CSV file")
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
     else:
-        table = Table(api_key=airtable_key, base_id=base_id, table_name=table_name)
-        r = table.update(submission_id, submission)  # update submission
+        airtable_cache = utils.get_airtable_cache(airtable_key, base_id, table_name)
+        r = await run_blocking(
+            airtable_cache.table.update, submission_id, submission
+        )  # update submission
+        airtable_cache.put(r)
         print(f"Set the record {r['id']} on Airtable")
         return JSONResponse(status_code=status.HTTP_200_OK)
 
@@ -768,12 +1045,16 @@ async def get_school_schedule(
     Returns school agenda from Airtable. Current function only
     return an edition 2021-1 since we made just for ACML 2021.
     """
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     if user_info is not None:
-        table = Table(
+        airtable_cache = utils.get_airtable_cache(
             airtable_key, es_config["editions"][edition]["airtable_id"], "school"
         )
-        submissions = [r.get("fields") for r in table.all() if len(r.get("fields")) > 0]
+        submissions = [
+            r.get("fields")
+            for r in await run_blocking(airtable_cache.all)
+            if len(r.get("fields")) > 0
+        ]
     else:
         submissions = []
     return JSONResponse(content={"data": submissions})
@@ -798,11 +1079,11 @@ async def update_payment(
     if amount not in amount_options:
         return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    user_info = get_user_info(authorization)
+    user_info = await run_blocking(get_user_info, authorization)
     user_id = user_info.get("user_id")
 
     if option == "check":
-        ref = get_data(user_id, collection)
+        ref = await run_blocking(get_data, user_id, collection, cache=False)
         if ref is None:
             ref = {"payment_status": "wait", "amount": amount}
         return JSONResponse(content=ref)
@@ -811,7 +1092,8 @@ async def update_payment(
         # create payment intent using Stripe API
         amount = int(amount) if str(amount).isdigit() else amount
         try:
-            session = stripe.PaymentIntent.create(
+            session = await run_blocking(
+                stripe.PaymentIntent.create,
                 amount=amount,
                 currency=currency,
                 payment_method_types=["card"],
@@ -823,7 +1105,8 @@ async def update_payment(
                 "payment_intent_id": session["id"],
                 "amount": amount,
             }
-            set_data(
+            await run_blocking(
+                set_data,
                 payment,
                 user_id,
                 "payment",
@@ -835,7 +1118,7 @@ async def update_payment(
 
     elif option == "set":
         # set the payment if payment is successful
-        payment_dict = get_data(user_id, "payment")
+        payment_dict = await run_blocking(get_data, user_id, "payment", cache=False)
         payment_intent_id = payment_dict["payment_intent_id"]
         client_secret = payload["client_secret"]
 
@@ -843,7 +1126,9 @@ async def update_payment(
         if str(payment_intent_id) not in str(client_secret):
             raise JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
 
-        payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        payment_intent = await run_blocking(
+            stripe.PaymentIntent.retrieve, payment_intent_id
+        )
         if payment_intent.status != "succeeded":
             return JSONResponse(
                 content={
@@ -853,7 +1138,8 @@ async def update_payment(
             )
 
         # set payment to Firebase
-        set_data(
+        await run_blocking(
+            set_data,
             {
                 "payment_status": "paid",
                 "payment_intent_id": payment_intent_id,
@@ -873,7 +1159,8 @@ async def update_payment(
 
     elif option == "waive":
         # set payment as waived
-        set_data(
+        await run_blocking(
+            set_data,
             {"payment_status": "waived", "amount": 0, "currency": "USD"},
             user_id,
             collection,
@@ -0,0 +1,13 @@
+"""
+Test setup, tests import ``utils`` from the backend folder as ``api.py`` does.
+``firebase_utils`` creates a Firestore client on import, which requires
+credentials, so it is replaced by a mock.
+"""
+import os.path as op
+import sys
+from unittest import mock
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), ".."))
+
+with mock.patch("google.cloud.firestore.Client"):
+    import utils  # noqa: F401
@@ -0,0 +1,70 @@
+import requests
+
+from utils.airtable_utils import AirtableRecordCache
+
+
+class FakeTable:
+    """Airtable table in memory, records every call to ``all`` and ``get``"""
+
+    def __init__(self, records: list):
+        self.records = {r["id"]: r for r in records}
+        self.formulas = []
+        self.gets = []
+        self.modified = set()  # IDs returned by the next filtered ``all``
+
+    def all(self, formula=None):
+        self.formulas.append(formula)
+        if formula is None:
+            return list(self.records.values())
+        return [self.records[i] for i in self.modified]
+
+    def get(self, record_id: str):
+        self.gets.append(record_id)
+        if record_id not in self.records:
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError("404 Not Found", response=response)
+        return self.records[record_id]
+
+
+def record(record_id: str, title: str) -> dict:
+    return {"id": record_id, "fields": {"title": title}}
+
+
+def test_refresh_only_fetches_modified_records():
+    table = FakeTable([record("rec1", "a"), record("rec2", "b")])
+    cache = AirtableRecordCache(table, ttl=60, reload_every=3600)
+    assert cache.get("rec1") == record("rec1", "a")
+    assert table.formulas == [None]  # initial full load
+
+    table.records["rec2"] = record("rec2", "b2")
+    table.records["rec3"] = record("rec3", "c")
+    del table.records["rec1"]
+    table.modified = {"rec2", "rec3"}
+    cache.refresh(force=True)
+
+    assert len(table.formulas) == 2
+    assert "IS_AFTER(LAST_MODIFIED_TIME()" in table.formulas[1]
+    assert cache.get("rec2") == record("rec2", "b2")
+    assert cache.get("rec3") == record("rec3", "c")
+    # deleted records are only dropped on full reload
+    assert cache.get("rec1") == record("rec1", "a")
+    assert table.gets == []
+
+
+def test_missing_record_is_not_requested_again():
+    table = FakeTable([record("rec1", "a")])
+    cache = AirtableRecordCache(table, ttl=60, reload_every=3600)
+    assert cache.get("recMissing") is None
+    assert cache.get("recMissing") is None
+    assert table.gets == ["recMissing"]
+
+
+def test_record_created_after_load_is_fetched_and_kept():
+    table = FakeTable([record("rec1", "a")])
+    cache = AirtableRecordCache(table, ttl=60, reload_every=3600)
+    cache.refresh()
+    table.records["rec2"] = record("rec2", "b")
+    assert cache.get("rec2") == record("rec2", "b")
+    assert cache.get("rec2") == record("rec2", "b")
+    assert table.gets == ["rec2"]
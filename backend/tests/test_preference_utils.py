@@ -0,0 +1,126 @@
+import copy
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from utils import firebase_utils, preference_utils
+from utils.preference_utils import WriteBehindPreferenceStore
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    """
+    In-memory preference collection, records document reads and batched
+    array updates, ``fail`` makes the next updates raise
+    """
+    store = SimpleNamespace(docs={}, reads=[], writes=[], fail=False)
+
+    def document(doc_id):
+        def get():
+            store.reads.append(doc_id)
+            return mock.Mock(to_dict=lambda: copy.deepcopy(store.docs.get(doc_id)))
+
+        return mock.Mock(get=get)
+
+    def update_arrays(updates, collection):
+        if store.fail:
+            raise RuntimeError("Firestore is unavailable")
+        store.writes.append(updates)
+        # as if written by another worker, the cache of this process is kept
+        for doc_id, field, add, remove in updates:
+            doc = store.docs.setdefault(doc_id, {})
+            values = [v for v in doc.get(field, []) if v not in remove]
+            doc[field] = values + [v for v in add if v not in values]
+
+    db = mock.Mock()
+    db.collection.return_value.document.side_effect = document
+    monkeypatch.setattr(firebase_utils, "db", db)
+    monkeypatch.setattr(preference_utils, "update_arrays", update_arrays)
+    firebase_utils.document_cache.clear()
+    yield store
+    firebase_utils.document_cache.clear()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "preference_log.sqlite3")
+
+
+def test_get_preference_applies_logged_votes(path, firestore):
+    firestore.docs["user"] = {"2020-1": ["1", "2"]}
+    store = WriteBehindPreferenceStore(path, "preference")
+    store.record("user", "2020-1", [("3", "like"), ("1", "dislike")])
+    store.record("user", "2020-2", [("4", "like")])
+    store.record("user", "2020-1", [("3", "dislike"), ("3", "like")])
+
+    assert store.get_preference("user") == {"2020-1": ["2", "3"], "2020-2": ["4"]}
+    assert store.get_preference("other") is None
+    assert firestore.writes == []
+    assert store.stats()["pending"] == 5
+
+
+def test_flush_writes_last_vote_and_empties_log(path, firestore):
+    store = WriteBehindPreferenceStore(path, "preference")
+    store.record("user", "2020-1", [("1", "like"), ("2", "like"), ("1", "dislike")])
+    store.record("other", "2020-1", [("2", "like")])
+
+    assert store.flush() == 4
+    assert sorted(firestore.writes[0]) == [
+        ("other", "2020-1", ["2"], []),
+        ("user", "2020-1", ["2"], ["1"]),
+    ]
+    assert store.stats()["pending"] == 0
+    assert store.flush() == 0  # nothing left to write
+    assert len(firestore.writes) == 1
+    assert store.get_preference("user") == {"2020-1": ["2"]}
+
+
+def test_failed_flush_keeps_votes(path, firestore):
+    store = WriteBehindPreferenceStore(path, "preference")
+    store.record("user", "2020-1", [("1", "like")])
+
+    firestore.fail = True
+    assert store.flush() == 0
+    assert store.stats()["pending"] == 1 and store.stats()["errors"] == 1
+
+    firestore.fail = False
+    assert store.flush() == 1
+    assert firestore.docs == {"user": {"2020-1": ["1"]}}
+
+
+def test_only_one_worker_holds_the_flush_lease(path, firestore):
+    first = WriteBehindPreferenceStore(path, "preference")
+    second = WriteBehindPreferenceStore(path, "preference")
+    first.record("user", "2020-1", [("1", "like")])
+
+    assert first._acquire_lease()
+    assert not second._acquire_lease()
+    assert second.flush() == 0  # another worker is flushing
+    assert firestore.writes == []
+    first._release_lease()
+    assert second.flush() == 1
+
+
+def test_flush_lease_expires(path, firestore):
+    first = WriteBehindPreferenceStore(path, "preference", lease_seconds=-1)
+    second = WriteBehindPreferenceStore(path, "preference")
+    assert first._acquire_lease()  # the worker died while flushing
+    assert second._acquire_lease()
+
+
+def test_get_preference_after_flush_of_another_worker(path, firestore):
+    firestore.docs["user"] = {"2020-1": ["1"]}
+    reader = WriteBehindPreferenceStore(path, "preference")
+    flusher = WriteBehindPreferenceStore(path, "preference")
+
+    reader.record("user", "2020-1", [("2", "like")])
+    assert reader.get_preference("user") == {"2020-1": ["1", "2"]}
+    assert reader.get_preference("user") == {"2020-1": ["1", "2"]}
+    assert firestore.reads == ["user"]  # the second read is from the cache
+
+    assert flusher.flush() == 1
+    # the vote left the log, the cached document without it must not be used
+    assert reader.get_preference("user") == {"2020-1": ["1", "2"]}
+    assert reader.get_preference("user") == {"2020-1": ["1", "2"]}
+    assert firestore.reads == ["user", "user"]
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.neighbors import NearestNeighbors
+
+from utils.recommendation_utils import NO_TIME, EmbeddingMatrix, to_epoch_ns
+
+
+def epoch_ns(value: str) -> int:
+    return pd.Timestamp(value).value
+
+
+def test_to_epoch_ns_mixed_formats():
+    times = to_epoch_ns(
+        [
+            "2020-10-26T10:00:00+00:00",
+            "2020-10-26T10:00:00.500000+00:00",
+            "2020-10-27",
+            "2020-10-26 10:00:00",
+            "2020-10-26T12:00:00+02:00",
+        ]
+    )
+    expected = [
+        epoch_ns("2020-10-26T10:00:00Z"),
+        epoch_ns("2020-10-26T10:00:00.5Z"),
+        epoch_ns("2020-10-27T00:00:00Z"),
+        epoch_ns("2020-10-26T10:00:00Z"),  # naive datetimes are in UTC
+        epoch_ns("2020-10-26T10:00:00Z"),
+    ]
+    np.testing.assert_array_equal(times, expected)
+
+
+def test_to_epoch_ns_invalid():
+    times = to_epoch_ns(["2020-10-26T10:00:00+00:00", None, "", "not a time"])
+    assert times[0] == epoch_ns("2020-10-26T10:00:00Z")
+    assert (times[1:] == NO_TIME).all()
+
+
+@pytest.mark.parametrize("k", [1, 10, 99, 100, None])
+def test_embedding_matrix_search_matches_kneighbors(k):
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((100, 16)).astype(np.float32)
+    query = rng.standard_normal(16).astype(np.float32)
+    embedding = EmbeddingMatrix(X, [str(i) for i in range(len(X))])
+
+    distances, rows = embedding.search(query, k)
+    n_neighbors = len(X) if k is None else k
+    nbrs = NearestNeighbors(n_neighbors=n_neighbors).fit(X)
+    expected_distances, expected_rows = nbrs.kneighbors(query.reshape(1, -1))
+    np.testing.assert_array_equal(rows, expected_rows.ravel())
+    np.testing.assert_allclose(distances, expected_distances.ravel(), rtol=1e-4)
+
+
+def test_embedding_matrix_search_within_rows():
+    rng = np.random.default_rng(1)
+    X = rng.standard_normal((50, 8)).astype(np.float32)
+    embedding = EmbeddingMatrix(X, [str(i) for i in range(len(X))])
+    rows = np.array([3, 7, 11, 20, 42])
+
+    distances, found = embedding.search(X[7], k=3, rows=rows)
+    assert found[0] == 7 and distances[0] < 1e-3
+    assert set(found) <= set(rows)
+    expected = rows[np.argsort(np.linalg.norm(X[rows] - X[7], axis=1))][:3]
+    np.testing.assert_array_equal(found, expected)
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from elasticsearch import NotFoundError
+
+from utils import submission_utils
+from utils.submission_utils import decode_cursor, encode_cursor, search_abstracts_after
+
+
+def hit(submission_id: str, starttime: str) -> dict:
+    return {
+        "_id": submission_id,
+        "_score": None,
+        "_source": {"submission_id": submission_id, "starttime": starttime},
+        "sort": [starttime, submission_id],
+    }
+
+
+def test_cursor_round_trip():
+    state = {"pit": "pit-1", "search_after": ["2020-10-26T10:00:00", "1"], "total": 3}
+    cursor = encode_cursor(state)
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+    assert decode_cursor(cursor) == state
+
+
+def test_decode_invalid_cursor():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+    assert decode_cursor("not a cursor") is None
+
+
+def test_search_abstracts_after_expired_point_in_time():
+    es = mock.MagicMock()
+    es.search.side_effect = [
+        NotFoundError(404, "search_context_missing_exception", {}),
+        {
+            "hits": {"hits": [hit("2", "2020-10-26T11:00:00")]},
+            "pit_id": "pit-new",
+        },
+    ]
+    es.open_point_in_time.return_value = {"id": "pit-new"}
+    search_after = ["2020-10-26T10:00:00", "1"]
+    cursor = encode_cursor({"pit": "pit-old", "search_after": search_after, "total": 2})
+
+    with mock.patch.object(submission_utils, "es", es):
+        submissions, next_cursor, total = search_abstracts_after(
+            index="agenda-2020-1", cursor=cursor, limit=1
+        )
+
+    assert [s["submission_id"] for s in submissions] == ["2"]
+    assert next_cursor is None and total == 2
+    # elasticsearch-dsl sends the request as body or as keyword arguments
+    expired, retried = [
+        c.kwargs.get("body", c.kwargs) for c in es.search.call_args_list
+    ]
+    assert expired["pit"]["id"] == "pit-old"
+    # continue after the same sort values in a new point-in-time
+    assert retried["pit"]["id"] == "pit-new"
+    assert retried["search_after"] == search_after
+    es.open_point_in_time.assert_called_once_with(
+        index="agenda-2020-1", keep_alive="1m"
+    )
+    es.close_point_in_time.assert_called_once_with(body={"id": "pit-new"})
@@ -1,4 +1,8 @@
+from utils.airtable_gateway import *
 from utils.airtable_utils import *
+from utils.async_utils import *
+from utils.cache_utils import *
 from utils.firebase_utils import *
+from utils.preference_utils import *
 from utils.recommendation_utils import *
 from utils.submission_utils import *
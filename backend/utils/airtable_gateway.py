@@ -0,0 +1,343 @@
+"""
+Gateway to the Airtable REST API shared by the backend and the scripts
+
+All Airtable requests go through one pooled ``requests.Session`` per API key,
+a token bucket per base sized to Airtable's limit of 5 requests/second,
+coalescing of identical in-flight GETs and exponential retries on 429 and 5xx.
+POST creates records and is not idempotent, so it is only retried when Airtable
+surely did not process it: on 429 and on connection timeouts. It only depends
+on ``requests`` so that scripts can import it with ``sys.path`` pointing to
+``backend/utils``.
+"""
+import time
+import copy
+import threading
+from typing import Optional
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+AIRTABLE_API_URL = "https://api.airtable.com/v0"
+AIRTABLE_RATE_LIMIT = 5  # requests per second per base
+AIRTABLE_PAGE_SIZE = 100  # maximum page size of list records
+AIRTABLE_BATCH_SIZE = 10  # maximum number of records per create or update
+RETRY_STATUS = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "PATCH", "DELETE")
+gateways = {}  # API key to AirtableGateway
+gateways_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, safe to share between threads
+
+    rate: float, tokens added per second
+    capacity: float, maximum number of tokens i.e. size of a burst
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, wait until one is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stop giving tokens for a given number of seconds, e.g. after a 429"""
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class AirtableGateway:
+    """
+    Airtable client for a given API key
+
+    api_key: str, Airtable API key
+    rate_limit: float, requests per second per base
+    max_retries: int, number of retries on 429, 5xx and connection errors,
+        on 429 and connection timeouts only for POST
+    backoff: float, seconds before the first retry, doubled on each retry
+    timeout: float, timeout of each request in seconds
+    pool_size: int, maximum number of pooled connections
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        rate_limit: float = AIRTABLE_RATE_LIMIT,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 30,
+        pool_size: int = 32,
+    ):
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        self._buckets = {}  # base ID to TokenBucket
+        self._inflight = {}  # GET request key to Future
+        self._lock = threading.Lock()
+
+    def bucket(self, base_id: str) -> TokenBucket:
+        """Get rate limiter of a given base"""
+        with self._lock:
+            if base_id not in self._buckets:
+                self._buckets[base_id] = TokenBucket(self.rate_limit)
+            return self._buckets[base_id]
+
+    def request(
+        self,
+        method: str,
+        base_id: str,
+        path: str = "",
+        params: Optional[dict] = None,
+        json: Optional[dict] = None,
+    ) -> requests.Response:
+        """
+        Send a request to ``{AIRTABLE_API_URL}/{base_id}/{path}`` within the
+        rate limit of the base, retry with exponential backoff and return the
+        last response. Idempotent methods are retried on 429, 5xx and
+        connection errors, POST only on 429 and connection timeouts since it
+        may have been processed otherwise
+        """
+        url = f"{AIRTABLE_API_URL}/{base_id}/{path}"
+        bucket = self.bucket(base_id)
+        retry_errors = (requests.ConnectionError, requests.Timeout)
+        retry_status = RETRY_STATUS
+        if method.upper() not in IDEMPOTENT_METHODS:
+            retry_errors, retry_status = (requests.ConnectTimeout,), (429,)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            delay = self.backoff * 2**attempt
+            try:
+                response = self.session.request(
+                    method, url, params=params, json=json, timeout=self.timeout
+                )
+            except retry_errors:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(delay)
+                continue
+            if response.status_code not in retry_status or attempt == self.max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if response.status_code == 429:
+                bucket.pause(delay)  # hold back other threads of this base too
+            time.sleep(delay)
+        return response
+
+    def request_json(self, method: str, base_id: str, path: str = "", **kwargs):
+        """Send a request, raise ``requests.HTTPError`` on error, return JSON"""
+        response = self.request(method, base_id, path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, base_id: str, path: str = "", params: Optional[dict] = None):
+        """
+        GET JSON, identical requests in flight at the same time
+        are sent once and all callers get the same result
+        """
+        key = (base_id, path, tuple(sorted((params or {}).items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if leader:
+            try:
+                result = self.request_json("GET", base_id, path, params=params)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+        # every caller gets its own copy since callers may modify it
+        return copy.deepcopy(future.result())
+
+    def table(self, base_id: str, table_name: str) -> "AirtableTable":
+        return AirtableTable(self, base_id, table_name)
+
+
+class AirtableTable:
+    """
+    Airtable table with a subset of ``pyairtable.Table`` API
+    (``get``, ``all``, ``create``, ``update``) that goes through the gateway
+    """
+
+    def __init__(self, gateway: AirtableGateway, base_id: str, table_name: str):
+        self.gateway = gateway
+        self.base_id = base_id
+        self.table_name = table_name
+        self.path = quote(table_name, safe="")
+
+    def get(self, record_id: str) -> dict:
+        """Get a record, raise ``requests.HTTPError`` if it does not exist"""
+        return self.gateway.get(self.base_id, f"{self.path}/{record_id}")
+
+    def all(
+        self,
+        formula: Optional[str] = None,
+        view: Optional[str] = None,
+        fields: Optional[list] = None,
+    ) -> list:
+        """Get all records, optionally filtered by a formula"""
+        params = {"pageSize": AIRTABLE_PAGE_SIZE}
+        if formula is not None:
+            params["filterByFormula"] = formula
+        if view is not None:
+            params["view"] = view
+        if fields is not None:
+            params["fields[]"] = tuple(fields)
+        records = []
+        while True:
+            page = self.gateway.get(self.base_id, self.path, params=params)
+            records.extend(page.get("records", []))
+            if page.get("offset") is None:
+                return records
+            params = {**params, "offset": page["offset"]}
+
+    def create(self, fields: dict, typecast: bool = False) -> dict:
+        """Create a record and return it"""
+        return self.gateway.request_json(
+            "POST",
+            self.base_id,
+            self.path,
+            json={"fields": fields, "typecast": typecast},
+        )
+
+    def update(self, record_id: str, fields: dict, typecast: bool = False) -> dict:
+        """Update some fields of a record and return it"""
+        return self.gateway.request_json(
+            "PATCH",
+            self.base_id,
+            f"{self.path}/{record_id}",
+            json={"fields": fields, "typecast": typecast},
+        )
+
+    def _batch(self, method: str, records: list, typecast: bool, max_workers: int):
+        """
+        Send records in chunks of ``AIRTABLE_BATCH_SIZE`` in parallel, the rate
+        limiter of the base bounds the request rate. A chunk is rejected as a
+        whole if one record is invalid, so a chunk rejected with a 4xx is
+        retried one record at a time to find the failing records. A POST that
+        failed otherwise (5xx, timeout) may have created the records, so its
+        chunk is reported as failed and not sent again.
+        """
+
+        def send(chunk: list):
+            payload = {"records": chunk, "typecast": typecast}
+            response = self.gateway.request(
+                method, self.base_id, self.path, json=payload
+            )
+            response.raise_for_status()
+            return response.json()["records"]
+
+        def send_chunk(start: int):
+            chunk = records[start : start + AIRTABLE_BATCH_SIZE]
+            try:
+                return send(chunk), []
+            except requests.RequestException as e:
+                resend = method in IDEMPOTENT_METHODS or _rejected(e)
+                if len(chunk) == 1 or not resend:
+                    message = _error_message(e)
+                    errors = [(start + i, message) for i in range(len(chunk))]
+                    return [None] * len(chunk), errors
+            results, errors = [], []
+            for i, record in enumerate(chunk):
+                try:
+                    results.extend(send([record]))
+                except requests.RequestException as e:
+                    results.append(None)
+                    errors.append((start + i, _error_message(e)))
+            return results, errors
+
+        starts = range(0, len(records), AIRTABLE_BATCH_SIZE)
+        results, errors = [], []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk_results, chunk_errors in executor.map(send_chunk, starts):
+                results.extend(chunk_results)
+                errors.extend(chunk_errors)
+        return results, errors
+
+    def batch_create(self, records: list, typecast: bool = False, max_workers: int = 4):
+        """
+        Create many records, ``records`` is a list of fields
+
+        Returns
+        =======
+        results: list, created records in the same order, None if it failed
+        errors: list, list of (index in ``records``, error message)
+        """
+        records = [{"fields": fields} for fields in records]
+        return self._batch("POST", records, typecast, max_workers)
+
+    def batch_update(self, records: list, typecast: bool = False, max_workers: int = 4):
+        """
+        Update some fields of many records,
+        ``records`` is a list of {"id": record ID, "fields": fields}
+
+        Returns
+        =======
+        results: list, updated records in the same order, None if it failed
+        errors: list, list of (index in ``records``, error message)
+        """
+        records = [{"id": r["id"], "fields": r["fields"]} for r in records]
+        return self._batch("PATCH", records, typecast, max_workers)
+
+
+def _rejected(e: requests.RequestException) -> bool:
+    """True if Airtable rejected the request with a 4xx i.e. wrote nothing"""
+    return e.response is not None and 400 <= e.response.status_code < 500
+
+
+def _error_message(e: requests.RequestException) -> str:
+    """Error message of a failed request, from the Airtable response if any"""
+    if e.response is not None:
+        try:
+            return str(e.response.json().get("error", e.response.text))
+        except ValueError:
+            return e.response.text
+    return str(e)
+
+
+def get_gateway(api_key: str) -> AirtableGateway:
+    """Get the gateway of a given API key, one per process"""
+    with gateways_lock:
+        if api_key not in gateways:
+            gateways[api_key] = AirtableGateway(api_key)
+        return gateways[api_key]
+
+
+def get_table(api_key: str, base_id: str, table_name: str) -> AirtableTable:
+    """
+    Get an Airtable table, drop-in for ``pyairtable.Table(api_key, base_id, table_name)``
+
+    Example
+    =======
+    >>> submissions = get_table(airtable_key, base_id, "submissions").all()
+    """
+    return get_gateway(api_key).table(base_id, table_name)
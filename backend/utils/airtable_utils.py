@@ -1,9 +1,19 @@
 """
 Utilities for Airtable
-We will mostly use pyairtable but we implement a few functions to use
+All requests go through the rate-limited gateway in ``utils.airtable_gateway``
 """
-import json
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
 import requests
+from utils.airtable_gateway import AirtableTable, get_gateway, get_table
+from utils.cache_utils import LRUCache
+
+AIRTABLE_CACHE_TTL = float(os.environ.get("AIRTABLE_CACHE_TTL", 60))
+AIRTABLE_CACHE_RELOAD = 60 * 60  # full reload to drop deleted records
+AIRTABLE_MISS_CACHE_SIZE = 4096  # record IDs known not to exist, per table
+airtable_caches = {}  # (base_id, table_name) to AirtableRecordCache
 
 
 def get_record(
@@ -16,11 +26,10 @@ def get_record(
     Get record from Airtable with a given record ID `record_id`
     """
     if record_id != "":
-        request_url = f"https://api.airtable.com/v0/{base_id}/{table_name}/{record_id}"
-        headers = {
-            "Authorization": f"Bearer {airtable_key}",
-        }
-        output = requests.get(request_url, headers=headers)
+        table = get_table(airtable_key, base_id, table_name)
+        output = get_gateway(airtable_key).request(
+            "GET", base_id, f"{table.path}/{record_id}"
+        )
         return output
     else:
         return None
@@ -51,13 +60,128 @@ def set_record(
           }
         ]
     }
-    >>> output = add_data_airtable(data)
-    >>> print(output)
+    >>> output = set_record(airtable_key, base_id, data)
+    >>> print(output["errors"])
+
+    Records are created in chunks of 10 in parallel within the rate limit,
+    failed records are reported in ``errors`` as (index, error message)
     """
-    headers = {
-        "Authorization": f"Bearer {airtable_key}",
-        "Content-Type": "application/json",
-    }
-    post_url = f"https://api.airtable.com/v0/{base_id}/{table_name}"
-    output = requests.post(post_url, data=json.dumps(data), headers=headers)
-    return output.json()
+    table = get_table(airtable_key, base_id, table_name)
+    records, errors = table.batch_create(
+        [r["fields"] for r in data["records"]], typecast=data.get("typecast", False)
+    )
+    return {"records": [r for r in records if r is not None], "errors": errors}
+
+
+class AirtableRecordCache:
+    """
+    Local copy of all records of an Airtable table, loaded in bulk and then
+    refreshed every ``ttl`` seconds with only records modified since the last
+    refresh, so reads do not hit the rate limit of 5 requests/second per base
+
+    table: AirtableTable, see ``utils.airtable_gateway.get_table``
+    ttl: float, seconds before checking Airtable for modified records
+    reload_every: float, seconds between full reloads, deleted records
+        are only dropped on full reload
+    miss_cache_size: int, number of record IDs not found in Airtable
+        remembered for ``ttl`` seconds, so that unknown IDs are not requested again
+    """
+
+    def __init__(
+        self,
+        table: AirtableTable,
+        ttl: float = AIRTABLE_CACHE_TTL,
+        reload_every: float = AIRTABLE_CACHE_RELOAD,
+        miss_cache_size: int = AIRTABLE_MISS_CACHE_SIZE,
+    ):
+        self.table = table
+        self.ttl = ttl
+        self.reload_every = reload_every
+        self.records = {}  # record ID to record {"id", "fields", "createdTime"}
+        self.refreshed_at = None  # monotonic time of the last refresh
+        self.reloaded_at = None  # monotonic time of the last full reload
+        self.modified_since = None  # UTC time to look for modified records
+        self.misses = LRUCache(maxsize=miss_cache_size, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = datetime.now(timezone.utc) - timedelta(minutes=1)  # clock skew
+        if (
+            self.reloaded_at is None
+            or time.monotonic() - self.reloaded_at > self.reload_every
+        ):
+            records = self.table.all()
+            self.records = {r["id"]: r for r in records}
+            self.reloaded_at = time.monotonic()
+        else:
+            since = self.modified_since.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            formula = (
+                f"OR(IS_AFTER(LAST_MODIFIED_TIME(), '{since}'), "
+                f"IS_AFTER(CREATED_TIME(), '{since}'))"
+            )
+            records = dict(self.records)  # copy on write, readers iterate records
+            records.update({r["id"]: r for r in self.table.all(formula=formula)})
+            self.records = records
+        self.modified_since = now
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self, force: bool = False):
+        """
+        Refresh records if the cache is older than ``ttl``, only one thread
+        refreshes while the others keep serving the current records
+        """
+        if self.refreshed_at is None:
+            with self._lock:  # wait for the initial load
+                if self.refreshed_at is None:
+                    self._refresh()
+            return
+        if force or time.monotonic() - self.refreshed_at > self.ttl:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                except Exception as e:
+                    print(f"Failed to refresh Airtable records: {e}")
+                finally:
+                    self._lock.release()
+
+    def get(self, record_id: str):
+        """
+        Get a record with a given ID, fetch it from Airtable
+        if it is not in the cache, return None if it does not exist.
+        IDs that do not exist are not requested again for ``ttl`` seconds.
+        """
+        self.refresh()
+        record = self.records.get(record_id)
+        if record is None:
+            if record_id in self.misses:
+                return None
+            try:
+                record = self.table.get(record_id)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    self.misses.set(record_id, True)
+                return None
+            self.put(record)
+        return record
+
+    def all(self):
+        """Get all records"""
+        self.refresh()
+        return list(self.records.values())
+
+    def put(self, record: dict):
+        """Put a record returned by Airtable after create or update"""
+        self.records = {**self.records, record["id"]: record}
+
+
+def get_airtable_cache(
+    airtable_key: str, base_id: str, table_name: str = "submissions"
+) -> AirtableRecordCache:
+    """
+    Get record cache of a given Airtable table, one per table in a worker
+    """
+    key = (base_id, table_name)
+    if key not in airtable_caches:
+        table = get_table(airtable_key, base_id, table_name)
+        airtable_caches.setdefault(key, AirtableRecordCache(table))
+    return airtable_caches[key]
@@ -0,0 +1,69 @@
+"""
+Utilities for approximate nearest neighbors (ANN) search
+
+ANN indices are built offline by scripts/embeddings.py (``--ann=hnsw``)
+and saved next to the embedding matrix as ``agenda-{edition}.{backend}.bin``.
+Backends are optional, if the library is not installed we fall back to exact search.
+"""
+import os.path as op
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph from ``hnswlib`` with L2 distance
+
+    index: hnswlib.Index, loaded index where labels are rows of the embedding matrix
+    ef: int, size of the dynamic candidate list, larger is more accurate but slower.
+        It is set once since the index is shared by the threads of a worker,
+        queries are limited to ``k <= ef``
+    """
+
+    name = "hnsw"
+
+    def __init__(self, index, ef: int = 100):
+        self.index = index
+        self.ef = ef
+        self.index.set_ef(ef)
+
+    @classmethod
+    def available(cls):
+        return hnswlib is not None
+
+    @classmethod
+    def load(cls, path: str, n_dimensions: int, ef: int = 100):
+        index = hnswlib.Index(space="l2", dim=n_dimensions)
+        index.load_index(path)
+        return cls(index, ef=ef)
+
+    def query(self, query: np.ndarray, k: int):
+        """
+        Return euclidean distances and rows of ``k`` approximate nearest neighbors
+        """
+        if k > self.ef:  # hnswlib requires ef >= k
+            raise ValueError(f"k = {k} is larger than ef = {self.ef}")
+        rows, sq_distances = self.index.knn_query(query.reshape(1, -1), k=k)
+        distances = np.sqrt(np.maximum(sq_distances.ravel(), 0))
+        return distances, rows.ravel().astype(np.int64)
+
+
+ANN_BACKENDS = {HNSWIndex.name: HNSWIndex}
+
+
+def load_ann_index(basepath: str, n_dimensions: int, ef: int = 100):
+    """
+    Load the first available ANN index saved with a given basepath,
+    e.g. ``../sitedata/embeddings/agenda-2020-1``, return None if there is none
+
+    ef: int, search parameter of the index, the largest ``k`` it can query
+    """
+    for name, backend in ANN_BACKENDS.items():
+        path = f"{basepath}.{name}.bin"
+        if op.exists(path) and backend.available():
+            return backend.load(path, n_dimensions, ef=ef)
+    return None
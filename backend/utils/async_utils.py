@@ -0,0 +1,28 @@
+"""
+Utilities to run blocking I/O off the asyncio event loop
+
+Firestore, ElasticSearch, Airtable, SendGrid and Stripe clients are synchronous,
+calling them directly in an ``async def`` handler stalls every other request
+of the worker. We run them in a bounded thread pool instead.
+"""
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 32))  # threads per uvicorn worker
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function in the I/O thread pool and await its result
+
+    Example
+    =======
+    >>> user = await run_blocking(get_data, user_id, user_collection)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        io_executor, functools.partial(func, *args, **kwargs)
+    )
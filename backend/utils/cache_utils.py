@@ -0,0 +1,98 @@
+"""
+Utilities for in-process caches
+"""
+import time
+import threading
+from typing import Optional
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size-bounded least-recently-used cache, safe to share between threads
+
+    maxsize: int, maximum number of items kept in the cache
+    ttl: float, if given, items expire ``ttl`` seconds after they are set
+
+    Example
+    =======
+    >>> cache = LRUCache(maxsize=2, ttl=60)
+    >>> cache.set("a", 1)
+    >>> cache.get("a")
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key to (value, expire time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Get value of a given key and mark it as recently used"""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            value, expire = self._data[key]
+            if expire is not None and expire < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """
+        Set value of a given key, evict the least recently used item if full
+
+        ttl: float, time to live of this item in seconds, default to ``self.ttl``
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expire)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove a given key from the cache if it exists"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all items from the cache"""
+        with self._lock:
+            self._data.clear()
+
+    def delete_if(self, predicate):
+        """Remove all keys for which ``predicate(key)`` is True"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def stats(self):
+        """Return size, hit and miss counts and hit rate of the cache"""
+        with self._lock:
+            n_lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / n_lookups if n_lookups > 0 else 0.0,
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            expire = self._data[key][1]
+            return expire is None or expire >= time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
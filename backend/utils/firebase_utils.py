@@ -1,19 +1,98 @@
 """
 Utilities for Firebase
 """
+import os
+import re
+import copy
+import json
+import time
+import hashlib
+import threading
 from typing import Optional
 from fastapi import status, Header
 from fastapi.responses import JSONResponse
 
 import google.cloud
 from google.cloud import firestore
-from google.oauth2 import id_token
+from google.auth import jwt
 from google.auth.transport.requests import Request
+from utils.cache_utils import LRUCache
 
 
 db = firestore.Client()
 HTTP_REQUEST = Request()
 
+# public certificates used to sign Firebase ID tokens, same as ``id_token``
+FIREBASE_CERTS_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509"
+    "/securetoken@system.gserviceaccount.com"
+)
+CERTS_DEFAULT_TTL = 60 * 60  # if the response has no Cache-Control max-age
+CERTS_MIN_REFRESH = 60  # seconds between forced fetches for unknown key IDs
+TOKEN_CACHE_SIZE = 4096
+cert_cache = LRUCache(maxsize=1)
+cert_lock = threading.Lock()  # fetch certs once per worker
+certs_fetched_at = 0.0
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)  # sha256 of token to claims
+
+# per-worker read-through cache of documents, writes from this worker
+# invalidate it, writes from other workers are seen after the ttl
+DOCUMENT_CACHE_SIZE = 4096
+DOCUMENT_CACHE_TTL = float(os.environ.get("FIRESTORE_CACHE_TTL", 15))
+document_cache = LRUCache(maxsize=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_CACHE_TTL)
+document_writes = 0  # incremented on every write, see ``get_data``
+NOT_CACHED = object()
+
+
+def get_firebase_certs(force: bool = False):
+    """
+    Get public certificates for Firebase ID tokens, cached for
+    ``max-age`` seconds given by the Cache-Control header of the response
+
+    force: bool, if True, fetch certificates even if they are cached unless
+        they were fetched less than ``CERTS_MIN_REFRESH`` seconds ago
+    """
+    global certs_fetched_at
+    force = force and time.monotonic() - certs_fetched_at > CERTS_MIN_REFRESH
+    certs = None if force else cert_cache.get("certs")
+    if certs is not None:
+        return certs
+    with cert_lock:
+        certs = None if force else cert_cache.get("certs")
+        if certs is not None:  # fetched by another thread
+            return certs
+        response = HTTP_REQUEST(FIREBASE_CERTS_URL, method="GET")
+        if response.status != 200:
+            raise ValueError(f"Could not fetch certificates at {FIREBASE_CERTS_URL}")
+        certs = json.loads(response.data.decode("utf-8"))
+        max_age = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        ttl = int(max_age.group(1)) if max_age is not None else CERTS_DEFAULT_TTL
+        cert_cache.set("certs", certs, ttl=ttl)
+        certs_fetched_at = time.monotonic()
+    return certs
+
+
+def verify_firebase_token(token: str):
+    """
+    Verify a Firebase ID token and return its claims, verified claims are
+    cached by the token hash until the token expires
+    """
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = token_cache.get(key)
+    if claims is not None:
+        if claims["exp"] > time.time():
+            return claims
+        token_cache.delete(key)
+
+    certs = get_firebase_certs()
+    if jwt.decode_header(token).get("kid") not in certs:
+        certs = get_firebase_certs(force=True)  # keys were rotated
+    claims = jwt.decode(token, certs=certs)
+    ttl = claims["exp"] - time.time()
+    if ttl > 0:
+        token_cache.set(key, claims, ttl=ttl)
+    return claims
+
 
 def get_user_info(authorization: Optional[str] = None):
     """
@@ -22,9 +101,9 @@ def get_user_info(authorization: Optional[str] = None):
     """
     try:
         token = authorization.replace("Bearer ", "")
-        user_info = id_token.verify_firebase_token(token, HTTP_REQUEST)
+        user_info = dict(verify_firebase_token(token))
         return user_info
-    except (ValueError, AttributeError) as e:
+    except (ValueError, AttributeError, KeyError) as e:
         return None
 
 
@@ -46,17 +125,44 @@ def delete_data(doc_id: str, collection: str):
     Delete a record with ``doc_id`` from a given ``collection``
     """
     db.collection(collection).document(doc_id).delete()
+    invalidate_data(doc_id, collection)
     print(f"Deleting {doc_id} from collection {collection}")
 
 
-def get_data(doc_id: str, collection: str):
-    """Get data with ``doc_id`` from a given Firebase collection"""
+def invalidate_data(doc_id: str, collection: str):
+    """Drop a document from the read-through cache after it is written"""
+    global document_writes
+    document_cache.delete((collection, doc_id))
+    document_writes += 1
+
+
+def invalidate_collection(collection: str):
+    """Drop all documents of a given collection from the read-through cache"""
+    global document_writes
+    document_cache.delete_if(lambda key: key[0] == collection)
+    document_writes += 1
+
+
+def get_data(doc_id: str, collection: str, cache: bool = True):
+    """
+    Get data with ``doc_id`` from a given Firebase collection,
+    documents are cached for ``DOCUMENT_CACHE_TTL`` seconds
+
+    cache: bool, if False, always read from Firestore e.g. for payments
+    """
+    key = (collection, doc_id)
+    doc = document_cache.get(key, NOT_CACHED) if cache else NOT_CACHED
+    if doc is not NOT_CACHED:
+        return copy.deepcopy(doc)  # callers may modify the document
+    n_writes = document_writes
     doc_ref = db.collection(collection).document(doc_id)
     try:
         doc = doc_ref.get().to_dict()
     except google.cloud.exceptions.NotFound:
         doc = None
         print(f"No user with id = {doc_id}!")
+    if n_writes == document_writes:  # do not cache if a write raced this read
+        document_cache.set(key, copy.deepcopy(doc))
     return doc
 
 
@@ -71,6 +177,7 @@ def set_data(data: dict, doc_id: Optional[str] = None, collection: str = ""):
             doc_id = data.get("email")
     doc_ref = db.collection(collection).document(doc_id)
     doc_ref.set(data)
+    invalidate_data(doc_id, collection)
     print(f"Set a record with {doc_id} to collection {collection}")
 
 
@@ -85,4 +192,40 @@ def update_data(data: dict, doc_id: Optional[str] = None, collection: str = ""):
             doc_id = data.get("email")
     doc_ref = db.collection(collection).document(doc_id)
     doc_ref.update(data)
+    invalidate_data(doc_id, collection)
     print(f"Set a record with {doc_id} to collection {collection}")
+
+
+def update_array(add: list, remove: list, doc_id: str, collection: str, field: str):
+    """
+    Add and remove values of an array ``field`` of a document atomically
+    in one batched write, ``add`` and ``remove`` should not overlap.
+    The document and the field are created if missing.
+    """
+    update_arrays([(doc_id, field, add, remove)], collection)
+
+
+def update_arrays(updates: list, collection: str, batch_size: int = 400):
+    """
+    Apply many array updates to a given Firebase collection in batched writes
+
+    updates: list, list of (doc_id, field, add, remove) where ``add`` and
+        ``remove`` are lists of values to add to or remove from the array ``field``
+    batch_size: int, maximum number of writes per batch, Firestore allows 500
+    """
+    writes = []
+    for doc_id, field, add, remove in updates:
+        doc_ref = db.collection(collection).document(doc_id)
+        if len(add) > 0:
+            writes.append((doc_ref, {field: firestore.ArrayUnion(list(add))}))
+        if len(remove) > 0:
+            writes.append((doc_ref, {field: firestore.ArrayRemove(list(remove))}))
+    try:
+        for i in range(0, len(writes), batch_size):
+            batch = db.batch()
+            for doc_ref, data in writes[i : i + batch_size]:
+                batch.set(doc_ref, data, merge=True)
+            batch.commit()
+    finally:
+        for doc_id, _, _, _ in updates:
+            invalidate_data(doc_id, collection)
@@ -0,0 +1,238 @@
+"""
+Write-behind store for user preferences (votes)
+
+Votes are appended to a local SQLite log (WAL mode, shared by all workers on
+the host, survives restarts), reads merge pending votes on top of the cached
+Firestore document and a periodic flush writes coalesced votes to Firestore in
+batches. Every flush bumps a generation in the log so that workers drop cached
+documents that may lack the flushed votes.
+Enable with ``PREFERENCE_WRITE_BEHIND=1`` in the environment file.
+"""
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+from contextlib import contextmanager
+from utils.firebase_utils import get_data, invalidate_collection, update_arrays
+
+PREFERENCE_WRITE_BEHIND = os.environ.get("PREFERENCE_WRITE_BEHIND", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+PREFERENCE_LOG_PATH = os.environ.get(
+    "PREFERENCE_LOG_PATH", "../sitedata/preference_log.sqlite3"
+)
+PREFERENCE_FLUSH_INTERVAL = float(os.environ.get("PREFERENCE_FLUSH_INTERVAL", 5))
+
+
+class WriteBehindPreferenceStore:
+    """
+    Preference store that logs votes locally and flushes them to Firestore
+
+    path: str, path to the SQLite log
+    collection: str, Firebase collection of preferences
+    flush_interval: float, seconds between flushes
+    max_flush_rows: int, maximum number of logged votes written per flush
+    lease_seconds: float, only one worker flushes at a time, the lease expires
+        after this many seconds if the worker dies while flushing
+    """
+
+    def __init__(
+        self,
+        path: str,
+        collection: str,
+        flush_interval: float = 5,
+        max_flush_rows: int = 10000,
+        lease_seconds: float = 60,
+    ):
+        self.path = path
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_flush_rows = max_flush_rows
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.n_flushed = 0
+        self.n_errors = 0
+        self.last_flush = None
+        self.generation = None  # last flush generation seen by this worker
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS votes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "edition TEXT NOT NULL, submission_id TEXT NOT NULL, "
+                "action TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS votes_user ON votes (user_id, seq)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS flush_lease ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), owner TEXT, expires REAL)"
+            )
+            self._conn.execute("INSERT OR IGNORE INTO flush_lease VALUES (1, NULL, 0)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS flush_generation ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)"
+            )
+            self._conn.execute("INSERT OR IGNORE INTO flush_generation VALUES (1, 0)")
+
+    @contextmanager
+    def _transaction(self, mode: str = "DEFERRED"):
+        """Run the statements of the block in one SQLite transaction"""
+        with self._lock:
+            self._conn.execute(f"BEGIN {mode}")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def record(self, user_id: str, edition: str, operations: list):
+        """
+        Log votes of a user, operations is a list of (submission_id, action)
+        where action can be "like" or "dislike"
+        """
+        now = time.time()
+        rows = [(user_id, edition, s, a, now) for s, a in operations]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO votes (user_id, edition, submission_id, action, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def get_preference(self, user_id: str):
+        """
+        Get preference document of a user from Firestore
+        with votes not yet flushed applied on top
+
+        Another worker may have flushed and removed votes from the log that the
+        cached document lacks, so cached documents of the collection are dropped
+        when the flush generation changed. The log and the generation are read
+        in one snapshot before the document, votes flushed meanwhile are then in
+        both and applying them again gives the same preference.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT edition, submission_id, action FROM votes "
+                "WHERE user_id = ? ORDER BY seq",
+                (user_id,),
+            ).fetchall()
+            (generation,) = conn.execute(
+                "SELECT generation FROM flush_generation WHERE id = 1"
+            ).fetchone()
+            if generation != self.generation:
+                invalidate_collection(self.collection)
+                self.generation = generation
+        preference = get_data(user_id, self.collection)
+        if len(rows) == 0:
+            return preference
+        preference = dict(preference or {})
+        for edition, submission_id, action in rows:
+            ids = [i for i in preference.get(edition, []) if i != submission_id]
+            if action == "like":
+                ids.append(submission_id)
+            preference[edition] = ids
+        return preference
+
+    def _acquire_lease(self):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE flush_lease SET owner = ?, expires = ? "
+                "WHERE id = 1 AND (expires < ? OR owner = ?)",
+                (self.owner, now + self.lease_seconds, now, self.owner),
+            )
+        return cursor.rowcount == 1
+
+    def _release_lease(self):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE flush_lease SET expires = 0 WHERE id = 1 AND owner = ?",
+                (self.owner,),
+            )
+
+    def flush(self):
+        """
+        Write logged votes to Firestore in batches, the last vote of a user
+        on a submission wins. Return the number of flushed votes.
+        Votes stay in the log if the write fails and are retried on the next flush.
+        """
+        if not self._acquire_lease():
+            return 0  # another worker is flushing
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, user_id, edition, submission_id, action FROM votes "
+                    "ORDER BY seq LIMIT ?",
+                    (self.max_flush_rows,),
+                ).fetchall()
+            if len(rows) == 0:
+                return 0
+            actions = {}  # (user_id, edition) to submission_id to last action
+            for _, user_id, edition, submission_id, action in rows:
+                actions.setdefault((user_id, edition), {})[submission_id] = action
+            updates = [
+                (
+                    user_id,
+                    edition,
+                    [s for s, a in votes.items() if a == "like"],
+                    [s for s, a in votes.items() if a == "dislike"],
+                )
+                for (user_id, edition), votes in actions.items()
+            ]
+            try:
+                update_arrays(updates, self.collection)
+            except Exception as e:
+                self.n_errors += 1
+                print(f"Failed to flush {len(rows)} votes: {e}")
+                return 0
+            with self._transaction("IMMEDIATE") as conn:
+                conn.execute("DELETE FROM votes WHERE seq <= ?", (rows[-1][0],))
+                conn.execute(
+                    "UPDATE flush_generation SET generation = generation + 1 "
+                    "WHERE id = 1"
+                )
+            self.n_flushed += len(rows)
+            self.last_flush = time.time()
+            return len(rows)
+        finally:
+            self._release_lease()
+
+    def stats(self):
+        """
+        Return flush metrics, ``flushLag`` is the age in seconds of the oldest
+        vote not yet written to Firestore
+        """
+        with self._lock:
+            n_pending, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created) FROM votes"
+            ).fetchone()
+        return {
+            "pending": n_pending,
+            "flushLag": time.time() - oldest if oldest is not None else 0.0,
+            "flushed": self.n_flushed,
+            "errors": self.n_errors,
+            "lastFlush": self.last_flush,
+        }
+
+
+def load_preference_store(collection: str) -> Optional[WriteBehindPreferenceStore]:
+    """
+    Return the write-behind preference store if ``PREFERENCE_WRITE_BEHIND``
+    is enabled, otherwise None and votes are written to Firestore directly
+    """
+    if not PREFERENCE_WRITE_BEHIND:
+        return None
+    return WriteBehindPreferenceStore(
+        PREFERENCE_LOG_PATH, collection, flush_interval=PREFERENCE_FLUSH_INTERVAL
+    )
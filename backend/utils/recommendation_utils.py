@@ -1,12 +1,22 @@
 """
 Utilities for recommendation
 """
+import os
+import os.path as op
+import json
+import time
+import hashlib
+import threading
+from glob import glob
 import numpy as np
 import pandas as pd
 from typing import Optional
 from sklearn.neighbors import NearestNeighbors
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
+from utils.cache_utils import LRUCache
+from utils.ann_utils import load_ann_index
+from utils.submission_utils import search_abstract_ids, convert_utc
 
 np.random.seed(seed=126)  # apply seed for exploration sampling
 
@@ -16,6 +26,41 @@ es = Elasticsearch(
     ]
 )
 
+# es_index.py touches this file after every reindex, see scripts/es_index.py
+INDEX_STAMP_PATH = op.join("..", "sitedata", ".es_index_stamp")
+ABSTRACT_CACHE_SIZE = 4096  # maximum number of abstracts cached per edition
+abstract_caches = {}  # ElasticSearch index to LRUCache of abstracts
+abstract_cache_stamp = None
+NO_TIME = np.iinfo(np.int64).min  # missing time in the slot table (same as NaT)
+slot_tables = {}  # ElasticSearch index to (stamp, embedding, starts, ends)
+EMBEDDING_DIR = op.join("..", "sitedata", "embeddings")
+# scripts/embeddings.py writes each run to a version directory and
+# points this file to it once all editions are written
+EMBEDDING_POINTER = "CURRENT"
+
+
+def read_index_stamp():
+    """Read modified time of the reindex stamp, None if never reindexed"""
+    try:
+        return os.stat(INDEX_STAMP_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_abstract_cache(index: str = "agenda-2020-1"):
+    """
+    Get abstract cache of a given index. All caches are dropped
+    as soon as es_index.py reindexes.
+    """
+    global abstract_cache_stamp
+    stamp = read_index_stamp()
+    if stamp != abstract_cache_stamp:
+        abstract_caches.clear()
+        abstract_cache_stamp = stamp
+    if index not in abstract_caches:
+        abstract_caches[index] = LRUCache(maxsize=ABSTRACT_CACHE_SIZE)
+    return abstract_caches[index]
+
 
 def get_abstract(index: str = "agenda-2020-1", id: str = "1"):
     """
@@ -25,9 +70,14 @@ def get_abstract(index: str = "agenda-2020-1", id: str = "1"):
     """
     # return submission if we find submission ID from elasticsearch
     if id != "":
+        cache = get_abstract_cache(index)
+        submission = cache.get(id)
+        if submission is not None:
+            return dict(submission)
         try:
             submission = es.get(index=index, id=id).get("_source", [])
-            return submission
+            cache.set(id, submission)
+            return dict(submission)
         except:
             return None
     else:
@@ -36,23 +86,321 @@ def get_abstract(index: str = "agenda-2020-1", id: str = "1"):
 
 def get_abstracts(index: str = "agenda-2020-1", ids: list = []):
     """
-    Get multiple abstracts from a given list of submission ids.
+    Get multiple abstracts from a given list of submission ids
+    in one ElasticSearch ``mget``, abstracts that are already cached are not fetched.
+    Abstracts are returned in the same order as ``ids``, missing abstracts are skipped.
 
     index: str, ElasticSearch index (see es_index.py) for the ElasticSearch name
     ids: list, list of abstract IDs
     """
     # return submission if we find submission ID from elasticsearch
     if len(ids) > 0:
-        try:
-            out = es.mget(index=index, body={"ids": ids})
-            submissions = [r["_source"] for r in out["docs"]]
-            return submissions
-        except:
-            return []
+        cache = get_abstract_cache(index)
+        submissions = {}
+        for idx in ids:
+            submission = cache.get(idx)
+            if submission is not None:
+                submissions[idx] = submission
+        missing_ids = list(dict.fromkeys(i for i in ids if i not in submissions))
+        if len(missing_ids) > 0:
+            try:
+                out = es.mget(index=index, body={"ids": missing_ids})
+            except:
+                return []
+            for r in out["docs"]:
+                if r.get("found"):
+                    cache.set(r["_id"], r["_source"])
+                    submissions[r["_id"]] = r["_source"]
+        return [dict(submissions[idx]) for idx in ids if idx in submissions]
     else:
         return []
 
 
+def ids_path(path: str):
+    """Path to the submission IDs sidecar of a given ``.npy`` embedding file"""
+    return op.splitext(path)[0] + ".ids.json"
+
+
+def meta_path(path: str):
+    """Path to the metadata sidecar (e.g. ``n_neighbors``) of a ``.npy`` embedding file"""
+    return op.splitext(path)[0] + ".meta.json"
+
+
+def read_embedding_version(embedding_dir: str = EMBEDDING_DIR):
+    """
+    Read the current embedding version written by scripts/embeddings.py,
+    None if embeddings are saved directly in ``embedding_dir`` (no versions)
+    """
+    try:
+        with open(op.join(embedding_dir, EMBEDDING_POINTER), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def load_embeddings(embedding_dir: str = EMBEDDING_DIR, version: Optional[str] = None):
+    """
+    Load all editions from a given directory to a dictionary of ``EmbeddingMatrix``.
+    Binary ``.npy`` stores are preferred, legacy JSON embeddings are used
+    for editions that do not have one yet.
+
+    version: str, if given, load the version directory ``{embedding_dir}/{version}``
+    """
+    if version is not None:
+        embedding_dir = op.join(embedding_dir, version)
+    embeddings = {}
+    for path in glob(op.join(embedding_dir, "*.json")):
+        name = op.basename(path).split(".")[0]
+        has_npy = op.exists(op.join(embedding_dir, name + ".npy"))
+        if path.endswith((".ids.json", ".meta.json")) or has_npy:
+            continue
+        with open(path, "r") as f:
+            embeddings[name] = EmbeddingMatrix.from_records(json.load(f))
+    for path in glob(op.join(embedding_dir, "*.npy")):
+        embeddings[op.basename(path).split(".")[0]] = EmbeddingMatrix.load(path)
+    return embeddings
+
+
+class EmbeddingSnapshot:
+    """
+    Embeddings of all editions from one version,
+    never modified once loaded so that a request can keep using it while
+    a newer snapshot is loaded
+
+    version: str, version directory, None if embeddings are not versioned
+    embeddings: dict, index to ``EmbeddingMatrix``
+    generation: int, incremented on each reload, part of recommendation cache keys
+    """
+
+    def __init__(
+        self,
+        version: Optional[str],
+        embeddings: dict,
+        generation: int = 0,
+    ):
+        self.version = version
+        self.embeddings = embeddings
+        self.generation = generation
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(
+        cls,
+        embedding_dir: str = EMBEDDING_DIR,
+        version: Optional[str] = None,
+        generation: int = 0,
+    ):
+        """
+        Load a version and compute what ``EmbeddingMatrix`` computes on
+        first use so that the first requests on it are not slower
+        """
+        embeddings = load_embeddings(embedding_dir, version=version)
+        for embedding in embeddings.values():
+            embedding.id_to_row, embedding.sq_norms
+        return cls(version, embeddings, generation=generation)
+
+
+class EmbeddingRegistry:
+    """
+    Current ``EmbeddingSnapshot`` of a worker, swapped by reference when
+    scripts/embeddings.py publishes a new version. Requests read
+    ``registry.snapshot`` once and finish on it even if it is swapped meanwhile.
+
+    embedding_dir: str, directory of embeddings written by scripts/embeddings.py
+
+    Example
+    =======
+    >>> registry = EmbeddingRegistry("../sitedata/embeddings")
+    >>> snapshot = registry.snapshot
+    >>> generate_recommendations(["1"], snapshot.embeddings, "agenda-2020-1")
+    >>> registry.reload()  # True if a new version was loaded
+    """
+
+    def __init__(self, embedding_dir: str = EMBEDDING_DIR):
+        self.embedding_dir = embedding_dir
+        self.n_reloads = 0
+        self.last_error = None
+        self._lock = threading.Lock()  # one reload at a time
+        version = read_embedding_version(embedding_dir)
+        self.snapshot = EmbeddingSnapshot.load(embedding_dir, version)
+
+    def reload(self, force: bool = False):
+        """
+        Load the current version if it changed (or always if ``force``)
+        and swap it in, return True if the snapshot was swapped.
+        The previous snapshot is kept and ``ValueError`` is raised if the new
+        version is missing, empty or drops editions that are served now
+        (unless ``force``), other errors while loading are raised as is.
+        """
+        with self._lock:
+            current = self.snapshot
+            version = read_embedding_version(self.embedding_dir)
+            if not force and version == current.version:
+                return False
+            try:
+                path = self.embedding_dir
+                if version is not None:
+                    path = op.join(self.embedding_dir, version)
+                if not op.isdir(path):
+                    raise ValueError(f"directory {path} does not exist")
+                snapshot = EmbeddingSnapshot.load(
+                    self.embedding_dir, version, generation=current.generation + 1
+                )
+                if len(snapshot.embeddings) == 0:
+                    raise ValueError("no embeddings")
+                dropped = current.embeddings.keys() - snapshot.embeddings.keys()
+                if len(dropped) > 0 and not force:
+                    raise ValueError(f"missing {', '.join(sorted(dropped))}")
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+                raise
+            # recommendations ranked with the previous embeddings are stale,
+            # requests still on it write with the previous generation in the key
+            recommendation_cache.clear()
+            user_recommendation_keys.clear()
+            self.snapshot = snapshot
+            self.n_reloads += 1
+            self.last_error = None
+        return True
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version,
+            "loadedAt": snapshot.loaded_at,
+            "editions": sorted(snapshot.embeddings.keys()),
+            "reloads": self.n_reloads,
+            "lastError": self.last_error,
+        }
+
+
+class EmbeddingMatrix:
+    """
+    Embeddings of one edition loaded once as a contiguous float32 matrix
+
+    matrix: np.ndarray, (n_submissions, n_dimensions) embedding matrix,
+        can be a read-only memory map of a ``.npy`` file
+    submission_ids: list, submission ID of each row of the matrix
+    ann_index: optional approximate nearest neighbors index, see ``utils.ann_utils``
+    n_neighbors: int, maximum number of recommendations, if None, no limit
+
+    Example
+    =======
+    >>> embedding = EmbeddingMatrix.load("../sitedata/embeddings/agenda-2020-1.npy")
+    >>> distances, rows = embedding.search(embedding.matrix[0])
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        submission_ids: list,
+        ann_index=None,
+        n_neighbors: Optional[int] = None,
+    ):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.submission_ids = np.asarray([str(sid) for sid in submission_ids])
+        self.ann_index = ann_index
+        self.n_neighbors = n_neighbors
+        self._id_to_row = None
+        self._sq_norms = None
+
+    @classmethod
+    def from_records(cls, records: list):
+        """Create from a list of {"submission_id": ..., "embedding": [...]}"""
+        matrix = np.array([r["embedding"] for r in records], dtype=np.float32)
+        return cls(matrix, [r["submission_id"] for r in records])
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Memory-map a ``.npy`` embedding matrix written by scripts/embeddings.py
+        with its sidecar ``.ids.json`` of submission IDs and ``.meta.json``
+        of metadata if any. Pages are shared between workers through the
+        OS page cache and only read when used.
+        An ANN index saved with the same basename is loaded if available.
+        """
+        matrix = np.load(path, mmap_mode="r")
+        with open(ids_path(path), "r") as f:
+            submission_ids = json.load(f)
+        meta = {}
+        if op.exists(meta_path(path)):
+            with open(meta_path(path), "r") as f:
+                meta = json.load(f)
+        ann_index = load_ann_index(
+            op.splitext(path)[0], matrix.shape[1], ef=RECOMMENDATION_MIN_DEPTH
+        )
+        return cls(
+            matrix,
+            submission_ids,
+            ann_index=ann_index,
+            n_neighbors=meta.get("n_neighbors"),
+        )
+
+    @property
+    def id_to_row(self):
+        """Mapping from submission ID to row, built on first use"""
+        if self._id_to_row is None:
+            self._id_to_row = {sid: row for row, sid in enumerate(self.submission_ids)}
+        return self._id_to_row
+
+    @property
+    def sq_norms(self):
+        """Squared norm of each row, computed on first use"""
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        return self._sq_norms
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def rows(self, submission_ids: list):
+        """Rows of given submission IDs, IDs that are not in the matrix are skipped"""
+        rows = [self.id_to_row[sid] for sid in submission_ids if sid in self.id_to_row]
+        return np.array(rows, dtype=np.int64)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+        exact: bool = False,
+    ):
+        """
+        Exact euclidean nearest neighbors of a given query vector
+        (same ranking as ``NearestNeighbors.kneighbors``) with a single matmul.
+        Only the ``k`` closest submissions are selected (``np.argpartition``)
+        and sorted, so the cost of sorting grows with ``k`` instead of the edition.
+        If an ANN index is loaded, top-k queries over all rows use it instead
+        when ``k`` is at most its ``ef``, deeper queries are exact.
+        Returns distances and rows of the ``k`` closest submissions.
+
+        query: np.ndarray, query vector
+        k: int, number of neighbors, if None, rank all submissions
+        rows: np.ndarray, if given, only search within these rows
+        exact: bool, if True, never use the ANN index
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        use_ann = self.ann_index is not None and not exact and rows is None
+        if use_ann and k is not None and 0 < k <= self.ann_index.ef and k < len(self):
+            return self.ann_index.query(query, k)
+
+        if rows is None:
+            matrix, sq_norms = self.matrix, self.sq_norms
+        else:
+            matrix, sq_norms = self.matrix[rows], self.sq_norms[rows]
+        sq_distances = sq_norms - 2 * (matrix @ query) + query @ query
+        distances = np.sqrt(np.maximum(sq_distances, 0))
+
+        if k is None or k >= len(distances):
+            top = np.argsort(distances, kind="stable")
+        elif k <= 0:
+            top = np.array([], dtype=np.int64)
+        else:
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top], kind="stable")]
+        return distances[top], (top if rows is None else rows[top])
+
+
 def generate_recommendations(
     submission_ids: list,
     data: dict,
@@ -62,64 +410,64 @@ def generate_recommendations(
     n_recommend: Optional[int] = None,
     alpha: float = 1.2,
     abstract_info: bool = False,
+    k: Optional[int] = None,
+    candidate_ids: Optional[list] = None,
 ):
     """
     Generate recommended submissions from a list of submission ids
     (Each ID here is an Airtable ID)
 
     submission_ids: list, list of IDs that we want to produce recommendation
-    data: list,  dictionary of index to embedding data mapping
+    data: dict, dictionary of index to ``EmbeddingMatrix``
     index: str, index of embedding data such as "agenda-2020-1", "agenda-2020-2", ...
-    nbrs_model: NearestNeighbors, nearest neighbors model
+    nbrs_model: NearestNeighbors, kept for backward compatibility, if given,
+        limit number of neighbors to ``nbrs_model.n_neighbors`` instead of
+        ``EmbeddingMatrix.n_neighbors``
     exploration: bool, if exploration is True, send
+    n_recommend: int, same as ``k``, kept for backward compatibility
     alpha: float, factor multiplying to the preference vector (for Rochhio algorithm)
     abstract_info: bool, if False, returning only indices,
         if True returning full abstracts queried from ElasticSearch
+    k: int, number of top recommendations, if None, rank all submissions
+    candidate_ids: list, if given, only recommend submissions from this list
 
     Example
     =======
     >>> embedding_files = glob("../sitedata/embeddings/*.json")
-    >>> data = {op.basename(f).split('.')[0]: json.load(open(f, "r")) for f in embedding_files}
-    >>> generate_recommendations([1], data, "agenda-2020-1", nbrs_model, abstract_info=True)
+    >>> data = {
+        op.basename(f).split('.')[0]: EmbeddingMatrix.from_records(json.load(open(f, "r")))
+        for f in embedding_files
+    }
+    >>> generate_recommendations([1], data, "agenda-2020-1", abstract_info=True)
     """
     if len(submission_ids) == 0:
         return []
 
-    idx_mapping = {
-        r["submission_id"]: r["embedding"] for r in data[index]
-    }  # submission to embedding
-    idx_subid_mapping = {
-        i: r["submission_id"] for i, r in enumerate(data[index])
-    }  # idx to submission
-    # only use submissions id that exist in keys
-    submission_ids = [sid for sid in submission_ids if sid in idx_mapping.keys()]
-    pref_vector = (
-        alpha
-        * np.mean(
-            [
-                np.array(idx_mapping.get(sid))
-                for sid in submission_ids
-                if sid in idx_mapping.keys()
-            ],
-            axis=0,
-        )
-        .reshape(-1, 1)
-        .T
-    )
-    distances, indices = nbrs_model.kneighbors(pref_vector)
-    indices = indices.ravel()
-    distances = distances.ravel()
+    embedding = data[index]
+    # only use submissions id that exist in the embedding matrix
+    rows = embedding.rows(submission_ids)
+    if len(rows) == 0:
+        return []
+    pref_vector = alpha * embedding.matrix[rows].mean(axis=0)
+    if k is None:
+        k = n_recommend
+    n_neighbors = embedding.n_neighbors
+    if nbrs_model is not None:
+        n_neighbors = nbrs_model.n_neighbors
+    if n_neighbors is not None:
+        k = min(k or n_neighbors, n_neighbors)
+    candidate_rows = None
+    if candidate_ids is not None:
+        candidate_rows = embedding.rows(candidate_ids)
+    distances, indices = embedding.search(pref_vector, k=k, rows=candidate_rows)
     # if exploration is True, we will sample with probabilities
     # calculated by the inverse distances
-    if exploration:
+    if exploration and len(indices) > 0:
         w = 1 / (distances + 1e-3)
         probs = w / np.sum(w)
         indices = np.random.choice(indices, size=len(indices), replace=False, p=probs)
-    recommend_indices = [
-        idx_subid_mapping.get(idx) for idx in indices if idx in idx_subid_mapping.keys()
-    ]  # recommendation indices
-    if n_recommend:
-        recommend_indices = recommend_indices[0 : n_recommend + 1]
+    # recommendation indices
+    recommend_indices = embedding.submission_ids[indices].tolist()
 
     if abstract_info:
         recommend_abstracts = get_abstracts(index, recommend_indices)
@@ -128,55 +476,224 @@ def generate_recommendations(
         return recommend_indices
 
 
+def to_epoch_ns(times: list):
+    """
+    Convert datetime strings to UTC epoch nanoseconds, ``NO_TIME`` if invalid.
+    Each value is parsed on its own so that values in different formats
+    (with or without fractional seconds, date only, naive or with an offset)
+    are all converted, naive datetimes are in UTC.
+    """
+    values = pd.Series(times, dtype=object)
+    try:
+        times = pd.to_datetime(values, utc=True, errors="coerce", format="mixed")
+    except (TypeError, ValueError):  # pandas < 2.0 has no format="mixed"
+        times = pd.to_datetime(values, utc=True, errors="coerce")
+    # NaT is the minimum int64
+    return times.values.astype("datetime64[ns]").astype(np.int64)
+
+
+def get_slot_table(index: str, embedding: EmbeddingMatrix):
+    """
+    Start and end time of each row of the embedding matrix as int64
+    epoch nanoseconds (``NO_TIME`` if missing), read once per edition
+    from ElasticSearch and refreshed after es_index.py reindexes.
+    """
+    stamp = read_index_stamp()
+    entry = slot_tables.get(index)
+    if entry is not None and entry[0] == stamp and entry[1] is embedding:
+        return entry[2], entry[3]
+
+    rows, starttimes, endtimes = [], [], []
+    for hit in helpers.scan(es, index=index, _source=["starttime", "endtime"]):
+        row = embedding.id_to_row.get(hit["_id"])
+        if row is not None:
+            rows.append(row)
+            starttimes.append(hit["_source"].get("starttime"))
+            endtimes.append(hit["_source"].get("endtime"))
+    starts = np.full(len(embedding), NO_TIME, dtype=np.int64)
+    ends = np.full(len(embedding), NO_TIME, dtype=np.int64)
+    if len(rows) > 0:
+        starts[rows] = to_epoch_ns(starttimes)
+        ends[rows] = to_epoch_ns(endtimes)
+    slot_tables[index] = (stamp, embedding, starts, ends)
+    return starts, ends
+
+
 def generate_personalized_recommendations(
     submission_ids: list,
-    data: list,
+    data: dict,
     index: str,
     nbrs_model: NearestNeighbors = None,
+    alpha: float = 1.2,
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+    abstract_info: bool = True,
 ):
     """
     Generate personalized recommendations
-    for a given submission ids, given data, index, and nearest neighbors model
+    for a given submission ids, given data, index, and nearest neighbors model.
+    For each time slot, pick a liked submission if there is one,
+    otherwise the closest recommendation. Selection is done on rows of the
+    embedding matrix and the slot table, abstracts are only fetched for the final agenda.
 
     submission_ids: list, list of IDs that we want to produce recommendation
-    data: dict, dictionary of index to embedding data mapping
+    data: dict, dictionary of index to ``EmbeddingMatrix``
     index: str, index of embedding data such as "agenda-2020-1", "agenda-2020-2", ...
-    nbrs_model: NearestNeighbors, nearest neighbors model
+    nbrs_model: NearestNeighbors, not used, kept for backward compatibility
+    alpha: float, factor multiplying to the preference vector (for Rochhio algorithm)
+    starttime: str, only keep submissions starting at or after starttime
+    endtime: str, only keep submissions ending at or before endtime
+    abstract_info: bool, if False, returning only indices,
+        if True returning full abstracts queried from ElasticSearch
 
     Example
     =======
-    >>> embedding_files = glob("../sitedata/embeddings/*.json")
-    >>> data = {op.basename(f).split('.')[0]: json.load(open(f, "r")) for f in embedding_files}
-    >>> generate_personalized_recommendations([1], data, "agenda-2020-1", nbrs_model, abstract_info=True)
+    >>> data = load_embeddings("../sitedata/embeddings")
+    >>> generate_personalized_recommendations(["1"], data, "agenda-2020-1")
     """
     if len(submission_ids) == 0:
         return []
 
-    rec_submissions = generate_recommendations(
-        submission_ids, data, index, nbrs_model, n_recommend=None, abstract_info=True
-    )
-    if len(rec_submissions) == 0:
+    embedding = data[index]
+    liked_rows = embedding.rows(submission_ids)
+    if len(liked_rows) == 0:
         return []
-    rec_submissions_df = pd.DataFrame(rec_submissions)
-    rec_submissions_df["starttime_sort"] = pd.to_datetime(rec_submissions_df.starttime)
-
-    # for other events, just recommend the closest event within a given starttime
-    selected_ids = list(set(submission_ids))
-    selected_df = pd.DataFrame(get_abstracts(index, selected_ids))
-    selected_df["starttime_sort"] = pd.to_datetime(selected_df.starttime)
-    personalized_rec_df = (
-        pd.concat((selected_df, rec_submissions_df), axis=0)
-        .groupby("starttime_sort")
-        .first()
-        .reset_index()
-        .sort_values("starttime_sort")
-    )
-    abstracts = personalized_rec_df.drop("starttime_sort", axis=1).to_dict(
-        orient="records"
-    )
-    personalized_abstracts = []
-    for row in abstracts:
-        personalized_abstracts.append(
-            {k: v for k, v in row.items() if not pd.isnull(v)}
+    starts, ends = get_slot_table(index, embedding)
+
+    # liked submissions first, then all submissions from the closest
+    pref_vector = alpha * embedding.matrix[liked_rows].mean(axis=0)
+    _, ranked_rows = embedding.search(pref_vector, exact=True)
+    order = np.concatenate([liked_rows, ranked_rows])
+    order = order[starts[order] != NO_TIME]
+    # first occurrence of each start time, sorted by start time
+    _, first = np.unique(starts[order], return_index=True)
+    selected_rows = order[first]
+
+    if starttime not in ["", None]:
+        selected_rows = selected_rows[
+            starts[selected_rows] >= convert_utc(starttime).value
+        ]
+    if endtime not in ["", None]:
+        selected_ends = ends[selected_rows]
+        selected_rows = selected_rows[
+            (selected_ends != NO_TIME) & (selected_ends <= convert_utc(endtime).value)
+        ]
+
+    personalized_ids = embedding.submission_ids[selected_rows].tolist()
+    if abstract_info:
+        return get_abstracts(index, personalized_ids)
+    else:
+        return personalized_ids
+
+
+RECOMMENDATION_CACHE_SIZE = 2048  # number of distinct vote sets cached per worker
+RECOMMENDATION_CACHE_TTL = 15 * 60  # seconds
+RECOMMENDATION_MIN_DEPTH = 200  # rank at least this many submissions per cache entry
+# (index, hash of liked IDs, embedding generation) to
+# {(view, exploration, starttime, endtime): entry}
+recommendation_cache = LRUCache(
+    maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL
+)
+# (user ID, index) to the recommendation cache key last served to the user
+user_recommendation_keys = LRUCache(maxsize=4 * RECOMMENDATION_CACHE_SIZE)
+
+
+def recommendation_cache_key(index: str, submission_ids: list, generation: int = 0):
+    """
+    Cache key of a given edition index, a set of liked submission IDs
+    and the generation of the embeddings they are ranked with
+    """
+    liked = "\n".join(sorted(set(str(sid) for sid in submission_ids)))
+    return (index, hashlib.sha1(liked.encode("utf-8")).hexdigest(), generation)
+
+
+def get_recommendation_ids(
+    submission_ids: list,
+    data: dict,
+    index: str,
+    k: Optional[int] = None,
+    nbrs_model: NearestNeighbors = None,
+    exploration: bool = False,
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+    view: str = "recommendations",
+    user_id: Optional[str] = None,
+    generation: int = 0,
+):
+    """
+    Ranked recommendation IDs served from a per-worker TTL and LRU cache keyed by
+    edition, hash of sorted liked IDs, embedding generation and exploration flag so that paging
+    through recommendations does not recompute them. If a deeper page than
+    the cached ranking is requested, the ranking is recomputed twice as deep.
+    Returns a tuple of ranked submission IDs and total number of recommendations.
+
+    submission_ids, data, index, nbrs_model, exploration: see ``generate_recommendations``
+    k: int, number of recommendations needed (e.g. skip + limit)
+    starttime, endtime: str, only recommend submissions between starttime and endtime
+    view: str, "recommendations" or "personalized"
+        (see ``generate_personalized_recommendations``)
+    user_id: str, if given, remember the cache key for ``invalidate_recommendations``
+    generation: int, ``EmbeddingSnapshot.generation`` of ``data``, rankings of
+        previous embeddings are never served
+    """
+    if len(submission_ids) == 0:
+        return [], 0
+
+    key = recommendation_cache_key(index, submission_ids, generation)
+    if user_id is not None:
+        user_recommendation_keys.set((user_id, index), key)
+    entries = recommendation_cache.get(key)
+    if entries is None:
+        entries = {}
+        recommendation_cache.set(key, entries)
+
+    variant = (view, exploration, starttime, endtime)
+    entry = entries.get(variant)
+    if entry is not None:
+        ids, depth, n_total = entry
+        if depth is None or len(ids) < depth or (k is not None and k <= depth):
+            return ids, n_total
+
+    if view == "personalized":
+        ids = generate_personalized_recommendations(
+            submission_ids,
+            data,
+            index,
+            starttime=starttime,
+            endtime=endtime,
+            abstract_info=False,
+        )
+        depth, n_total = None, len(ids)
+    else:
+        candidate_ids = None
+        if starttime not in ["", None] or endtime not in ["", None]:
+            candidate_ids = search_abstract_ids(index, starttime, endtime)
+        depth = None
+        if k is not None:
+            previous_depth = entry[1] if entry is not None else 0
+            depth = max(k, RECOMMENDATION_MIN_DEPTH, 2 * previous_depth)
+        ids = generate_recommendations(
+            submission_ids,
+            data,
+            index,
+            nbrs_model=nbrs_model,
+            exploration=exploration,
+            k=depth,
+            candidate_ids=candidate_ids,
         )
-    return personalized_abstracts
+        if depth is None or len(ids) < depth:
+            n_total = len(ids)  # all recommendations are ranked
+        elif candidate_ids is not None:
+            n_total = len(data[index].rows(candidate_ids))
+        else:
+            n_total = len(data[index])
+    entries[variant] = (ids, depth, n_total)
+    return ids, n_total
+
+
+def invalidate_recommendations(user_id: str, index: str):
+    """Drop cached recommendations last served to a user, e.g. after a vote"""
+    key = user_recommendation_keys.get((user_id, index))
+    if key is not None:
+        recommendation_cache.delete(key)
+        user_recommendation_keys.delete((user_id, index))
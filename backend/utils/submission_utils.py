@@ -1,13 +1,15 @@
 """
 Utilities for submission query from ElasticSearch
 """
+import json
+import base64
 import pandas as pd
 from typing import Optional
 
 from pytz import timezone
 from datetime import timedelta
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, NotFoundError
 from elasticsearch_dsl import Search
 
 es = Elasticsearch(
@@ -102,6 +104,218 @@ def query_abstracts(
     return responses
 
 
+def build_abstract_search(
+    q: Optional[str] = None,
+    index: str = "agenda-2020-1",
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: list = ["title^2", "abstract", "fullname", "institution"],
+    tiebreak: bool = False,
+):
+    """
+    Build a single ElasticSearch request for the abstract browser
+
+    q: str, query string, if empty match all abstracts
+    index: str, index of ElasticSearch
+    starttime: str, only keep abstracts starting at or after starttime (UTC if no tz)
+    endtime: str, only keep abstracts ending at or before endtime (UTC if no tz)
+    sort: str, ``starttime``, ``-starttime`` or ``relevance``,
+        if not given, sort by relevance when ``q`` is given, otherwise by starttime
+    fields: list, list of fields that are included in the search
+    tiebreak: bool, if True, add submission_id to the sort (for ``search_after``)
+    """
+    es_search = Search(using=es, index=index)
+    if sort not in ["starttime", "-starttime", "relevance"]:
+        sort = None
+    if q is None or q.strip() == "":
+        es_search = es_search.query("match_all")
+        if sort is None:
+            sort = "starttime"
+    else:
+        es_search = es_search.query("multi_match", query=q, fields=fields)
+        if sort is None:
+            sort = "relevance"
+
+    # filter in ElasticSearch instead of filtering every hit in Python
+    if starttime not in ["", None]:
+        es_search = es_search.filter(
+            "range", starttime={"gte": convert_utc(starttime).isoformat()}
+        )
+    if endtime not in ["", None]:
+        es_search = es_search.filter(
+            "range", endtime={"lte": convert_utc(endtime).isoformat()}
+        )
+
+    if sort in ["starttime", "-starttime"]:
+        order = "desc" if sort.startswith("-") else "asc"
+        es_search = es_search.sort({"starttime": {"order": order}})
+    if tiebreak:
+        # search_after needs a total order, break ties with submission_id
+        sort_fields = es_search.to_dict().get("sort", ["_score"])
+        es_search = es_search.sort(*sort_fields, {"submission_id": {"order": "asc"}})
+    return es_search
+
+
+def search_abstracts(
+    q: Optional[str] = None,
+    index: str = "agenda-2020-1",
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+    sort: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 40,
+):
+    """
+    Search, filter, sort and paginate abstracts in one ElasticSearch request.
+    Returns a tuple of submissions for the requested page and
+    the exact number of abstracts matching the query and filters
+
+    q: str, query string
+    index: str, index of ElasticSearch
+    starttime: str, starttime filter
+    endtime: str, endtime filter
+    sort: str, see ``build_abstract_search``
+    skip: int, number of abstracts to skip
+    limit: int, number of abstracts to return
+    """
+    es_search = build_abstract_search(
+        q, index=index, starttime=starttime, endtime=endtime, sort=sort
+    )
+    es_search = es_search.extra(track_total_hits=True)[skip : skip + limit]
+    responses = es_search.execute().to_dict()["hits"]
+    submissions = convert_es_responses_to_list(responses["hits"])
+    return submissions, responses["total"]["value"]
+
+
+def search_abstract_ids(
+    index: str = "agenda-2020-1",
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+):
+    """
+    Get submission IDs of all abstracts between starttime and endtime
+    without fetching the abstracts themselves
+    """
+    es_search = build_abstract_search(
+        index=index, starttime=starttime, endtime=endtime, sort="relevance"
+    )
+    return [hit.meta.id for hit in es_search.source(False).scan()]
+
+
+def encode_cursor(state: dict):
+    """Encode pagination state to an opaque, URL safe cursor"""
+    cursor = base64.urlsafe_b64encode(json.dumps(state).encode("utf-8"))
+    return cursor.decode("utf-8").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str] = None):
+    """Decode a cursor created by ``encode_cursor``, return None if invalid"""
+    if cursor is None or cursor == "":
+        return None
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        return None
+
+
+def open_point_in_time(index: str, keep_alive: str = "5m"):
+    """
+    Open a point-in-time on a given index so that every page of a cursor
+    sees the same snapshot. Return None if the cluster does not support it
+    (ElasticSearch < 7.10), we then fall back to ``search_after`` on the index.
+    """
+    try:
+        return es.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+    except Exception:
+        return None
+
+
+def close_point_in_time(pit_id: Optional[str] = None):
+    """Close a point-in-time once the last page is served"""
+    if pit_id is None:
+        return
+    try:
+        es.close_point_in_time(body={"id": pit_id})
+    except Exception:
+        pass
+
+
+def search_abstracts_after(
+    q: Optional[str] = None,
+    index: str = "agenda-2020-1",
+    starttime: Optional[str] = None,
+    endtime: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 40,
+    keep_alive: str = "1m",
+):
+    """
+    Cursor based pagination of abstracts with ``search_after`` and point-in-time.
+    Every page costs the same no matter how deep the cursor is.
+    One more abstract than ``limit`` is fetched to know if there is a next page,
+    the point-in-time is closed on the last page.
+    Returns a tuple of submissions, the cursor of the next page
+    (None if this is the last page) and the total number of matching abstracts
+
+    q, index, starttime, endtime, sort: see ``build_abstract_search``
+    cursor: str, cursor returned by the previous page, None for the first page
+    limit: int, number of abstracts per page
+    keep_alive: str, how long ElasticSearch keeps the point-in-time between pages,
+        short so that points-in-time of clients that stop scrolling expire soon,
+        a cursor whose point-in-time expired continues in a new one
+    """
+    state = decode_cursor(cursor)
+    if state is None:
+        # first page, count the total once and carry it in the cursor
+        state = {"pit": open_point_in_time(index, keep_alive), "total": None}
+
+    def execute(pit_id: Optional[str] = None):
+        es_search = build_abstract_search(
+            q,
+            index=index if pit_id is None else None,
+            starttime=starttime,
+            endtime=endtime,
+            sort=sort,
+            tiebreak=True,
+        )
+        if pit_id is not None:
+            es_search = es_search.extra(pit={"id": pit_id, "keep_alive": keep_alive})
+        if state.get("search_after") is not None:
+            es_search = es_search.extra(search_after=state["search_after"])
+        es_search = es_search.extra(track_total_hits=state.get("total") is None)
+        return es_search[0 : limit + 1].execute().to_dict()
+
+    pit_id = state.get("pit")
+    try:
+        responses = execute(pit_id)
+    except NotFoundError:
+        if pit_id is None:
+            raise
+        # the point-in-time expired (client idle for longer than keep_alive),
+        # continue after the sort values of the cursor in a new point-in-time
+        pit_id = open_point_in_time(index, keep_alive)
+        responses = execute(pit_id)
+
+    hits = responses["hits"]["hits"]
+    total = state.get("total")
+    if total is None:
+        total = responses["hits"]["total"]["value"]
+    pit_id = responses.get("pit_id", pit_id)  # point-in-time ID can change
+
+    if len(hits) <= limit:
+        close_point_in_time(pit_id)
+        next_cursor = None
+    else:
+        hits = hits[:limit]
+        next_cursor = encode_cursor(
+            {"pit": pit_id, "search_after": hits[-1]["sort"], "total": total}
+        )
+    return convert_es_responses_to_list(hits), next_cursor, total
+
+
 def get_agenda(
     index: str = "agenda-2020-1", starttime: Optional[str] = None, sort: bool = True
 ):
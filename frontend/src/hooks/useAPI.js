@@ -1,4 +1,4 @@
-import { useCallback } from "react"
+import { useCallback, useEffect, useRef } from "react"
 import useFirebaseWrapper from "./useFirebaseWrapper"
 
 const endpoints = {
@@ -13,6 +13,9 @@ const endpoints = {
   payment: "/api/payment",
 }
 
+// votes clicked within this delay are sent together in one request
+const VOTE_DEBOUNCE_MS = 1000
+
 const contentTypeHeader = {
   "Content-Type": "application/json",
 }
@@ -23,6 +26,59 @@ const authHeader = token => ({
 
 function useAPI() {
   const { idToken } = useFirebaseWrapper()
+  // queued votes { edition, submissionId, action, resolve, reject }
+  const voteQueue = useRef([])
+  const voteTimer = useRef(null)
+
+  const reactOnAbstracts = useCallback(
+    ({ edition, operations }) => {
+      return fetch(`${endpoints.preference}/${edition}`, {
+        method: "PATCH",
+        headers: {
+          ...contentTypeHeader,
+          ...authHeader(idToken),
+        },
+        body: JSON.stringify({
+          operations,
+        }),
+      })
+    },
+    [idToken]
+  )
+
+  const flushReactions = useCallback(() => {
+    clearTimeout(voteTimer.current)
+    voteTimer.current = null
+    const votes = voteQueue.current
+    voteQueue.current = []
+
+    const votesByEdition = {}
+    votes.forEach(vote => {
+      votesByEdition[vote.edition] = [
+        ...(votesByEdition[vote.edition] || []),
+        vote,
+      ]
+    })
+    Object.entries(votesByEdition).forEach(([edition, editionVotes]) => {
+      reactOnAbstracts({
+        edition,
+        operations: editionVotes.map(({ submissionId, action }) => ({
+          submission_id: submissionId,
+          action,
+        })),
+      })
+        .then(res => {
+          if (!res.ok) {
+            throw new Error(`Failed to update votes (${res.status})`)
+          }
+          editionVotes.forEach(vote => vote.resolve(res))
+        })
+        .catch(err => editionVotes.forEach(vote => vote.reject(err)))
+    })
+  }, [reactOnAbstracts])
+
+  // send queued votes before unmount instead of dropping them
+  useEffect(() => flushReactions, [flushReactions])
 
   return {
     getAffiliation: useCallback(q => {
@@ -176,6 +232,29 @@ function useAPI() {
       },
       [idToken]
     ),
+    reactOnAbstracts,
+    /**
+     * @description queue a vote and send queued votes in one request
+     * once no vote has been clicked for VOTE_DEBOUNCE_MS
+     * @returns {Promise} settled when the batch holding this vote is sent
+     */
+    queueReactionOnAbstract: useCallback(
+      ({ edition, submissionId, action }) => {
+        return new Promise((resolve, reject) => {
+          voteQueue.current.push({
+            edition,
+            submissionId,
+            action,
+            resolve,
+            reject,
+          })
+          clearTimeout(voteTimer.current)
+          voteTimer.current = setTimeout(flushReactions, VOTE_DEBOUNCE_MS)
+        })
+      },
+      [flushReactions]
+    ),
+    flushReactions,
     /**
      * @param {('check'|'create'|'set'|'waive')} option
      */
@@ -285,7 +285,7 @@ export default () => {
   const {
     getPreference,
     getAbstractsForBrowser,
-    reactOnAbstract,
+    queueReactionOnAbstract,
     getPaginatedAbstractsForBrowser,
   } = useAPI()
   const { isLoggedIn } = useFirebaseWrapper()
@@ -306,6 +306,7 @@ export default () => {
    * @type {[SubmissionDataObj[], function]} SubmissionData
    */
   const [submissionData, setSubmissionData] = useState([])
+  // eslint-disable-next-line no-unused-vars
   const [submissionMeta, setSubmissionMeta] = useState({})
   const [submissionLinks, setSubmissionLinks] = useState({})
   // this is true when fetching and false when done fetching
@@ -398,6 +399,9 @@ export default () => {
     // do NOT add q if view is not default
     if (params.get("view") !== "default") {
       params.delete("q")
+    } else {
+      // default view is paginated with a cursor so that deep pages stay fast
+      params.set("paginate", "cursor")
     }
 
     let fetchParams = ""
@@ -429,7 +433,6 @@ export default () => {
     timezone,
   ])
 
-  const { currentPage, totalPage } = submissionMeta
   const { next } = submissionLinks
 
   return (
@@ -633,7 +636,7 @@ export default () => {
                         setPressedItemData(submissionData?.[pressedInd])
                       }}
                       parentWidth={width}
-                      hasNextPage={currentPage < totalPage}
+                      hasNextPage={Boolean(next)}
                       isNextPageLoading={loading}
                       list={submissionData}
                       loadNextPage={() => {
@@ -666,7 +669,8 @@ export default () => {
                           )
                         }
 
-                        reactOnAbstract({
+                        // votes are debounced and sent in one batch request
+                        queueReactionOnAbstract({
                           edition: displayEdition.value,
                           submissionId,
                           action,
@@ -680,12 +684,12 @@ export default () => {
                             // if update failed, revert like status locally
                             if (action === "like") {
                               // remove from list
-                              setMyPreferences(
-                                myPreferences.filter(x => x !== submissionId)
+                              setMyPreferences(prev =>
+                                prev.filter(x => x !== submissionId)
                               )
                             } else {
                               // add to list
-                              setMyPreferences([...myPreferences, submissionId])
+                              setMyPreferences(prev => [...prev, submissionId])
                             }
                           })
                           .finally(() => setLoading(false))
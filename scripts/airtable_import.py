@@ -0,0 +1,109 @@
+"""
+Bulk import a CSV file to Airtable e.g. schedule times, URLs or tracks of submissions
+
+Rows are matched to existing records by a key column, ``submission_id`` (default)
+or ``id`` match the Airtable record ID, any other key matches a field of the table.
+Matched records are updated and, with ``--create``, other rows are created.
+Empty cells are not sent so that they do not erase existing values.
+Records are sent in chunks of 10 in parallel within Airtable's rate limit.
+
+Usage:
+    airtable_import.py <csv> --edition=<edition> [--table=<table>] [--key=<key>] [--create] [--typecast] [--workers=<workers>]
+    airtable_import.py [-h | --help]
+
+Options:
+    -h --help                   Show this screen
+    --edition=<edition>         Edition in es_config.yml with an airtable_id e.g. ``2021-4``
+    --table=<table>             Airtable table, default to table_name of the edition
+    --key=<key>                 Column used to match rows to records, ``submission_id`` and ``id``
+                                are record IDs [default: submission_id]
+    --create                    Create records for rows that do not match any record
+    --typecast                  Let Airtable convert values e.g. create select options
+    --workers=<workers>         Number of chunks sent in parallel [default: 4]
+"""
+import os
+import os.path as op
+import sys
+import yaml
+from docopt import docopt
+from dotenv import load_dotenv
+import pandas as pd
+
+sys.path.append(op.join(op.dirname(op.abspath(__file__)), "..", "backend", "utils"))
+from airtable_gateway import get_table  # rate-limited Airtable client
+
+load_dotenv(dotenv_path="../.env")  # setting all credentials here
+RECORD_ID_KEYS = ("submission_id", "id")  # columns holding the Airtable record ID
+assert os.environ.get(
+    "AIRTABLE_KEY"
+), "Please check if AIRTABLE_KEY is specified in environment file"
+airtable_key = os.environ.get("AIRTABLE_KEY")
+
+
+def row_fields(row: dict, key: str):
+    """Fields of a row to send to Airtable, without the key column and empty cells"""
+    return {k: v for k, v in row.items() if k != key and v != ""}
+
+
+def print_errors(errors: list, rows: list, key: str):
+    """Print failed rows with their error message"""
+    for i, message in errors:
+        print(f"  {key}={rows[i].get(key)}: {message}")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    with open("es_config.yml") as f:
+        es_config = yaml.load(f, Loader=yaml.FullLoader)
+    edition = es_config["editions"][arguments["--edition"]]
+    assert (
+        edition.get("airtable_id") is not None
+    ), "Please specify airtable_id of the edition in es_config.yml"
+    key = arguments["--key"]
+    typecast = arguments["--typecast"]
+    n_workers = int(arguments["--workers"])
+    table = get_table(
+        airtable_key,
+        edition["airtable_id"],
+        arguments["--table"] or edition["table_name"],
+    )
+
+    df = pd.read_csv(arguments["<csv>"], dtype=str).fillna("")
+    assert key in df.columns, f"Column {key} is missing from the CSV file"
+    rows = df.to_dict(orient="records")
+
+    # map key to record ID with one paginated read of the key field
+    if key in RECORD_ID_KEYS:
+        record_ids = {r["id"]: r["id"] for r in table.all(fields=[])}
+    else:
+        record_ids = {
+            str(r["fields"][key]): r["id"]
+            for r in table.all(fields=[key])
+            if r["fields"].get(key) is not None
+        }
+    updates = [row for row in rows if row[key] in record_ids]
+    creates = [row for row in rows if row[key] not in record_ids]
+
+    _, errors = table.batch_update(
+        [
+            {"id": record_ids[row[key]], "fields": row_fields(row, key)}
+            for row in updates
+        ],
+        typecast=typecast,
+        max_workers=n_workers,
+    )
+    print(f"Updated {len(updates) - len(errors)}/{len(updates)} records")
+    print_errors(errors, updates, key)
+
+    if arguments["--create"]:
+        # record IDs are given by Airtable, other keys are fields of new records
+        create_key = key if key in RECORD_ID_KEYS else None
+        _, errors = table.batch_create(
+            [row_fields(row, create_key) for row in creates],
+            typecast=typecast,
+            max_workers=n_workers,
+        )
+        print(f"Created {len(creates) - len(errors)}/{len(creates)} records")
+        print_errors(errors, creates, key)
+    elif len(creates) > 0:
+        print(f"Skipped {len(creates)} rows without a matching record, see --create")
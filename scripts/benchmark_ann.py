@@ -0,0 +1,91 @@
+"""
+Benchmark approximate nearest neighbors (HNSW) against the exact search
+used by the backend, reports recall@k and query latency.
+Requires the optional ``hnswlib``, see ``backend/requirements-optional.txt``
+
+Usage:
+    benchmark_ann.py [--edition=<edition>] [--n=<n>] [--dim=<dim>] [--k=<k>] [--n_queries=<n_queries>] [--ef=<ef>]
+    benchmark_ann.py [-h | --help]
+
+Options:
+    -h --help                   Show this screen
+    --edition=<edition>         Use embeddings of an edition in sitedata/embeddings e.g. ``2020-3``,
+                                if not given, use random embeddings
+    --n=<n>                     Number of random embeddings [default: 20000]
+    --dim=<dim>                 Dimension of random embeddings [default: 768]
+    --k=<k>                     Number of neighbors to retrieve [default: 200]
+    --n_queries=<n_queries>     Number of queries [default: 200]
+    --ef=<ef>                   Comma separated HNSW ``ef`` search parameters [default: 200,400,800]
+"""
+
+import os.path as op
+import time
+from docopt import docopt
+
+import numpy as np
+import hnswlib
+
+
+def current_version_path(save_path: str) -> str:
+    """Same as ``current_version_path`` in embeddings.py"""
+    pointer = op.join(save_path, "CURRENT")
+    if not op.exists(pointer):
+        return save_path
+    with open(pointer) as f:
+        return op.join(save_path, f.read().strip())
+
+
+def exact_search(X: np.ndarray, sq_norms: np.ndarray, query: np.ndarray, k: int):
+    """Same exact search as ``EmbeddingMatrix.search`` in the backend"""
+    sq_distances = sq_norms - 2 * (X @ query) + query @ query
+    top = np.argpartition(sq_distances, k - 1)[:k]
+    return top[np.argsort(sq_distances[top])]
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    k = int(arguments["--k"])
+    n_queries = int(arguments["--n_queries"])
+    ef_list = [int(ef) for ef in arguments["--ef"].split(",")]
+
+    if arguments.get("--edition") is not None:
+        basepath = op.join(
+            current_version_path(op.join("..", "sitedata", "embeddings")),
+            f"agenda-{arguments['--edition']}",
+        )
+        X = np.load(basepath + ".npy")
+    else:
+        rng = np.random.default_rng(126)
+        X = rng.standard_normal((int(arguments["--n"]), int(arguments["--dim"])))
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    sq_norms = np.einsum("ij,ij->i", X, X)
+    k = min(k, len(X))
+
+    # preference vectors are means of a few liked submissions
+    rng = np.random.default_rng(0)
+    queries = np.vstack(
+        [1.2 * X[rng.choice(len(X), size=3)].mean(axis=0) for _ in range(n_queries)]
+    )
+
+    # same parameters as ``build_ann_index`` in embeddings.py
+    tic = time.perf_counter()
+    index = hnswlib.Index(space="l2", dim=X.shape[1])
+    index.init_index(max_elements=len(X), ef_construction=200, M=16)
+    index.add_items(X, np.arange(len(X)))
+    print(f"Built HNSW index of {X.shape} in {time.perf_counter() - tic:.2f}s")
+
+    tic = time.perf_counter()
+    truth = [exact_search(X, sq_norms, q, k) for q in queries]
+    exact_ms = 1000 * (time.perf_counter() - tic) / n_queries
+    print(f"exact          recall@{k} = 1.000  latency = {exact_ms:.3f} ms/query")
+
+    for ef in ef_list:
+        index.set_ef(max(ef, k))
+        tic = time.perf_counter()
+        results = [index.knn_query(q.reshape(1, -1), k=k)[0].ravel() for q in queries]
+        ann_ms = 1000 * (time.perf_counter() - tic) / n_queries
+        recall = np.mean([len(set(r) & set(t)) / k for r, t in zip(results, truth)])
+        print(
+            f"hnsw ef={ef:<5d} recall@{k} = {recall:.3f}  latency = {ann_ms:.3f} ms/query "
+            f"({exact_ms / ann_ms:.1f}x)"
+        )
@@ -0,0 +1,97 @@
+"""
+Benchmark SPECTER inference on CPU, reports abstracts/sec of the fast inference
+mode used by embeddings.py against the previous fixed-size batches and the
+cosine similarity of their embeddings
+
+Usage:
+    benchmark_specter.py --edition=<edition> [--n=<n>] [--threads=<threads>] [--max_tokens=<max_tokens>] [--quantize]
+    benchmark_specter.py [-h | --help]
+
+Options:
+    -h --help                   Show this screen
+    --edition=<edition>         Edition in es_config.yml e.g. ``2020-3``
+    --n=<n>                     Number of abstracts to encode [default: 500]
+    --threads=<threads>         Number of CPU threads, default to PyTorch default
+    --max_tokens=<max_tokens>   Maximum number of tokens in a batch [default: 8192]
+    --quantize                  Also benchmark the int8 quantized model
+"""
+
+import time
+import yaml
+from docopt import docopt
+
+import numpy as np
+import torch
+
+from embeddings import (
+    MAX_BATCH_SIZE,
+    chunks,
+    encode_specter,
+    load_specter,
+    read_edition,
+)
+
+
+def encode_reference(texts: list, tokenizer, model) -> np.ndarray:
+    """Previous inference: fixed batches of ``MAX_BATCH_SIZE`` with autograd"""
+    embeddings = []
+    for g in chunks(texts, chunk_size=MAX_BATCH_SIZE):
+        inputs = tokenizer(
+            g, padding=True, truncation=True, return_tensors="pt", max_length=512
+        )
+        result = model(**inputs)
+        embeddings.append(result.last_hidden_state[:, 0, :].detach().numpy())
+    return np.vstack(embeddings)
+
+
+def cosine_similarity(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity of two matrices"""
+    return np.einsum("ij,ij->i", X, Y) / (
+        np.linalg.norm(X, axis=1) * np.linalg.norm(Y, axis=1)
+    )
+
+
+def benchmark(name: str, encode, texts: list, reference: np.ndarray = None):
+    tic = time.perf_counter()
+    X = encode(texts)
+    elapsed = time.perf_counter() - tic
+    line = f"{name:<12s} {len(texts) / elapsed:8.1f} abstracts/sec"
+    if reference is not None:
+        similarity = cosine_similarity(X, reference)
+        line += f"  cosine mean = {similarity.mean():.6f}  min = {similarity.min():.6f}"
+    print(line)
+    return X
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    n_threads = arguments.get("--threads")
+    n_threads = int(n_threads) if n_threads is not None else None
+    max_tokens = int(arguments["--max_tokens"])
+
+    with open("es_config.yml") as f:
+        es_config = yaml.load(f, Loader=yaml.FullLoader)
+    df = read_edition(es_config["editions"][arguments["--edition"]])
+    texts = list(df["title"] + "[SEP]" + df["abstract"])[: int(arguments["--n"])]
+    print(
+        f"Encode {len(texts)} abstracts with {n_threads or torch.get_num_threads()} threads"
+    )
+
+    tokenizer, model = load_specter(n_threads=n_threads)
+    reference = benchmark(
+        "reference", lambda t: encode_reference(t, tokenizer, model), texts
+    )
+    benchmark(
+        "fast",
+        lambda t: encode_specter(t, tokenizer, model, max_tokens=max_tokens),
+        texts,
+        reference,
+    )
+    if arguments["--quantize"]:
+        tokenizer, model = load_specter(n_threads=n_threads, quantize=True)
+        benchmark(
+            "fast int8",
+            lambda t: encode_specter(t, tokenizer, model, max_tokens=max_tokens),
+            texts,
+            reference,
+        )
@@ -3,7 +3,7 @@ Transform text to embeddings using
 Original code from https://github.com/Mini-Conf/Mini-Conf/blob/master/scripts/embeddings.py
 
 Usage:
-    embeddings.py [--option=<option>] [--n_components=<n_components>] [--n_recommend=<n_recommend>]
+    embeddings.py [--option=<option>] [--n_components=<n_components>] [--n_recommend=<n_recommend>] [--ann=<ann>] [--no_cache] [--threads=<threads>] [--max_tokens=<max_tokens>] [--quantize] [--workers=<workers>] [--keep=<keep>]
     embeddings.py [-h | --help]
     embeddings.py [-v | --version]
 
@@ -13,30 +13,52 @@ Options:
     --option=<option>               Embedding calculation, can be ``lsa`` or ``sent_embed``, default ``lsa``
     --n_components=<n_components>   Number of components for LSA
     --n_recommend=<n_recommend>     Number of recommendation, if not defined, recommend all submissions
+    --ann=<ann>                     Also build an approximate nearest neighbors index, can be ``hnsw`` (requires hnswlib)
+    --no_cache                      Encode all submissions with SPECTER instead of reusing cached embeddings
+    --threads=<threads>             Number of CPU threads used by SPECTER, default to PyTorch default
+    --max_tokens=<max_tokens>       Maximum number of tokens in a SPECTER batch, including padding [default: 8192]
+    --quantize                      Quantize SPECTER linear layers to int8, faster on CPU with slightly different embeddings
+    --workers=<workers>             Number of worker processes, SPECTER shards of all editions or LSA of each edition
+                                    are computed in parallel [default: 1]
+    --keep=<keep>                   Number of previous embedding versions to keep [default: 2]
 """
 import os
 import os.path as op
+import sys
 import json
+import time
 import yaml
+import shutil
+import hashlib
+import multiprocessing
 from glob import glob
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
 from docopt import docopt
 from dotenv import load_dotenv
 
-import joblib
 import numpy as np
 import pandas as pd
-from pyairtable import Table
 from tqdm.auto import tqdm
+import torch
 from transformers import AutoTokenizer, AutoModel
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.decomposition import TruncatedSVD
-from sklearn.neighbors import NearestNeighbors
 
 from es_index import read_submissions, keys_airtable
 
+sys.path.append(op.join(op.dirname(op.abspath(__file__)), "..", "backend", "utils"))
+from airtable_gateway import get_table  # rate-limited Airtable client
+
 load_dotenv(dotenv_path="../.env")  # setting all credentials here
 MAX_BATCH_SIZE = 16
+MAX_BATCH_PAPERS = 64  # maximum number of papers in a SPECTER batch
+MAX_BATCH_TOKENS = 8192  # maximum number of tokens in a SPECTER batch
+SPECTER_MODEL = "allenai/specter"
+EMBEDDING_POINTER = "CURRENT"  # name of the current version, read by the backend
+PUBLISHED_MARKER = ".published"  # in version directories that were published
+worker_specter = None  # (tokenizer, model) loaded once per worker process
 assert os.environ.get(
     "AIRTABLE_KEY"
 ), "Please check if AIRTABLE_KEY is specified in environment file"
@@ -61,15 +83,214 @@ def preprocess(text):
     return text.lower()
 
 
-def calculate_embeddings(df, option="lsa", n_papers=MAX_BATCH_SIZE, n_components=30):
+def load_specter(n_threads: Optional[int] = None, quantize: bool = False):
+    """
+    Load SPECTER tokenizer and model for CPU inference
+
+    n_threads: int, number of threads used by PyTorch, if None, keep the default
+    quantize: bool, if True, apply dynamic int8 quantization to linear layers
+    """
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    tokenizer = AutoTokenizer.from_pretrained(SPECTER_MODEL)
+    model = AutoModel.from_pretrained(SPECTER_MODEL).eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return tokenizer, model
+
+
+def token_batches(lengths: list, max_tokens: int, max_papers: int):
+    """
+    Group indices of texts into batches of similar lengths, longest first,
+    such that a padded batch has at most ``max_tokens`` tokens
+    and ``max_papers`` texts
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batch = []
+    for i in order:
+        # texts are sorted by length so the first one sets the padded length
+        if len(batch) > 0 and (
+            len(batch) == max_papers
+            or (len(batch) + 1) * lengths[batch[0]] > max_tokens
+        ):
+            yield batch
+            batch = []
+        batch.append(i)
+    if len(batch) > 0:
+        yield batch
+
+
+def encode_specter(
+    texts: list,
+    tokenizer,
+    model,
+    max_tokens: int = MAX_BATCH_TOKENS,
+    max_papers: int = MAX_BATCH_PAPERS,
+    progress: bool = True,
+) -> np.ndarray:
+    """
+    Encode texts to SPECTER embeddings (first token of the last hidden state)
+    without autograd, in batches of texts with similar lengths
+    so that little compute is spent on padding
+
+    Returns
+    =======
+    embeddings: np.ndarray, float32 matrix with one row per text
+    """
+    encoded = tokenizer(texts, truncation=True, max_length=512)
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+    embeddings = np.zeros((len(texts), model.config.hidden_size), dtype=np.float32)
+    batches = list(token_batches(lengths, max_tokens, max_papers))
+    with torch.inference_mode():
+        for batch in tqdm(batches, disable=not progress):
+            inputs = tokenizer.pad(
+                {k: [v[i] for i in batch] for k, v in encoded.items()},
+                return_tensors="pt",
+            )
+            result = model(**inputs)
+            embeddings[batch] = result.last_hidden_state[:, 0, :].float().numpy()
+    return embeddings
+
+
+def init_specter_worker(n_threads: Optional[int], quantize: bool):
+    """Load SPECTER once in a worker process of ``encode_specter_parallel``"""
+    global worker_specter
+    worker_specter = load_specter(n_threads=n_threads, quantize=quantize)
+
+
+def encode_specter_shard(shard: tuple) -> np.ndarray:
+    """Encode a shard (texts, max_tokens, max_papers) in a worker process"""
+    texts, max_tokens, max_papers = shard
+    tokenizer, model = worker_specter
+    return encode_specter(
+        texts, tokenizer, model, max_tokens, max_papers, progress=False
+    )
+
+
+def encode_specter_parallel(
+    texts: list,
+    n_workers: int,
+    n_threads: Optional[int] = None,
+    quantize: bool = False,
+    max_tokens: int = MAX_BATCH_TOKENS,
+    max_papers: int = MAX_BATCH_PAPERS,
+    shards_per_worker: int = 4,
+) -> np.ndarray:
+    """
+    Encode texts with SPECTER in a pool of worker processes, each worker
+    loads the model once and encodes shards of texts. Texts are dealt to
+    shards from the longest so that shards take about the same time.
+
+    n_workers: int, number of worker processes
+    n_threads: int, number of threads per worker,
+        if None, split the CPUs evenly between workers
+    shards_per_worker: int, more shards balance the load between workers
+
+    Returns
+    =======
+    embeddings: np.ndarray, float32 matrix with one row per text
+    """
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    n_shards = min(len(texts), n_workers * shards_per_worker)
+    shards = [order[i::n_shards] for i in range(n_shards)]
+    embeddings = None
+    # spawn new processes, PyTorch thread pools are not safe to fork
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_specter_worker,
+        initargs=(n_threads, quantize),
+    ) as executor:
+        results = executor.map(
+            encode_specter_shard,
+            [([texts[i] for i in shard], max_tokens, max_papers) for shard in shards],
+        )
+        for shard, X in zip(shards, tqdm(results, total=n_shards)):
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), X.shape[1]), dtype=np.float32)
+            embeddings[shard] = X
+    return embeddings
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings of a model keyed by sha1 of the encoded text,
+    saved as ``{cache_dir}/{model_name}.npy`` with a sidecar ``.keys.json``
+
+    cache_dir: str, directory of the cache, if None, only keep it in memory
+    model_name: str, e.g. ``allenai/specter``, embeddings of different
+        models are kept in different files
+    """
+
+    def __init__(self, cache_dir: Optional[str], model_name: str):
+        self.path = None
+        self.vectors = {}  # sha1 of text to embedding
+        if cache_dir is None:
+            return
+        self.path = op.join(cache_dir, model_name.replace("/", "__"))
+        if op.exists(self.path + ".npy") and op.exists(self.path + ".keys.json"):
+            with open(self.path + ".keys.json") as f:
+                keys = json.load(f)
+            self.vectors = dict(zip(keys, np.load(self.path + ".npy")))
+
+    @staticmethod
+    def key(text: str):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str):
+        return self.vectors.get(self.key(text))
+
+    def set(self, text: str, embedding):
+        self.vectors[self.key(text)] = np.asarray(embedding, dtype=np.float32)
+
+    def clear(self):
+        self.vectors = {}
+
+    def save(self):
+        """Save the cache, files are replaced atomically"""
+        if self.path is None or len(self.vectors) == 0:
+            return
+        os.makedirs(op.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp.npy", "wb") as f:
+            np.save(f, np.vstack(list(self.vectors.values())))
+        with open(self.path + ".keys.tmp.json", "w") as f:
+            json.dump(list(self.vectors.keys()), f)
+        os.replace(self.path + ".tmp.npy", self.path + ".npy")
+        os.replace(self.path + ".keys.tmp.json", self.path + ".keys.json")
+
+
+def specter_texts(df) -> list:
+    """SPECTER input of each submission, title and abstract separated by [SEP]"""
+    return list(df["title"] + "[SEP]" + df["abstract"])
+
+
+def calculate_embeddings(
+    df,
+    option="lsa",
+    n_papers=MAX_BATCH_PAPERS,
+    n_components=30,
+    cache=None,
+    max_tokens=MAX_BATCH_TOKENS,
+    n_threads=None,
+    quantize=False,
+):
     """Calculates embeddings from a given dataframe
     assume dataframe has title and abstract in the columns
 
     option: str, if ``lsa`` use Latent Semantic Analysis
         if ``sent_embed`` use Specter from AllenAI
-    n_papers: int, default 10
-        Group papers into smaller list for embedding computations
-        Larger one takes too long on regular laptop
+    n_papers: int, default 64
+        Maximum number of papers in a batch for embedding computations
+    cache: EmbeddingCache, if given, only encode papers that are not in the
+        cache with ``sent_embed`` and add them to the cache
+    max_tokens: int, maximum number of tokens in a batch including padding,
+        papers of similar lengths are batched together
+    n_threads: int, number of CPU threads for ``sent_embed``
+    quantize: bool, if True, quantize SPECTER to int8 for ``sent_embed``
     """
     assert option in ["lsa", "sent_embed"]
     if len(df) < n_components:
@@ -79,19 +300,21 @@ def calculate_embeddings(df, option="lsa", n_papers=MAX_BATCH_SIZE, n_components
         )
         option = "sent_embed"
     if option == "sent_embed":
-        print("Download SPECTER model for creating embedding\n")
-        tokenizer = AutoTokenizer.from_pretrained("allenai/specter")
-        model = AutoModel.from_pretrained("allenai/specter")
-        papers = list(df["title"] + "[SEP]" + df["abstract"])
-        # group papers
-        embeddings = []
-        for g in tqdm(chunks(papers, chunk_size=n_papers)):
-            inputs = tokenizer(
-                g, padding=True, truncation=True, return_tensors="pt", max_length=512
+        papers = specter_texts(df)
+        if cache is None:
+            cache = EmbeddingCache(None, SPECTER_MODEL)
+        # only encode new or changed papers, unique texts once
+        missing = list(dict.fromkeys(p for p in papers if cache.get(p) is None))
+        print(f"Encode {len(missing)}/{len(papers)} papers, reuse the others")
+        if len(missing) > 0:
+            print("Download SPECTER model for creating embedding\n")
+            tokenizer, model = load_specter(n_threads=n_threads, quantize=quantize)
+            X = encode_specter(
+                missing, tokenizer, model, max_tokens=max_tokens, max_papers=n_papers
             )
-            result = model(**inputs)
-            embeddings.extend(result.last_hidden_state[:, 0, :])
-        embeddings = [emb.tolist() for emb in embeddings]
+            for paper, emb in zip(missing, X):
+                cache.set(paper, emb)
+        embeddings = [cache.get(p).tolist() for p in papers]
         paper_embeddings = [
             {"submission_id": str(pid), "embedding": embedding}
             for pid, embedding in zip(df.submission_id, embeddings)
@@ -122,12 +345,150 @@ def calculate_embeddings(df, option="lsa", n_papers=MAX_BATCH_SIZE, n_components
     return paper_embeddings
 
 
+def read_edition(edition: dict) -> pd.DataFrame:
+    """
+    Read submissions of an edition in es_config.yml from
+    a JSON or CSV ``path`` or from Airtable
+    """
+    path = edition.get("path", "")
+    if path.lower().endswith(".json"):
+        df = pd.read_json(path).fillna("")
+    elif path.lower().endswith(".csv"):
+        df = pd.read_csv(path).fillna("")
+    elif edition.get("airtable_id") is not None:
+        # if filter_accepted, only filter accepted submissions
+        filter_accepted = edition.get("filter_accepted", False)
+        submissions = get_table(
+            airtable_key, edition["airtable_id"], edition["table_name"]
+        ).all()
+        submissions = read_submissions(
+            submissions, keys=keys_airtable, filter_accepted=filter_accepted
+        )
+        df = pd.DataFrame(submissions).fillna("")
+    else:
+        df = pd.read_csv(path).fillna("")
+    return df
+
+
+def save_embeddings(
+    basepath: str, X: np.ndarray, submission_ids: list, n_neighbors: int
+):
+    """
+    Save embeddings as a float32 ``.npy`` matrix (memory-mapped by the backend)
+    with a sidecar ``.ids.json`` list of submission IDs, one per row, and
+    a sidecar ``.meta.json`` with the number of recommendations ``n_neighbors``.
+    Legacy JSON embeddings, nearest neighbors models (``.joblib``) and
+    stale ANN indices with the same basename are removed.
+    """
+    np.save(basepath + ".npy", np.ascontiguousarray(X, dtype=np.float32))
+    with open(basepath + ".ids.json", "w") as f:
+        json.dump([str(sid) for sid in submission_ids], f)
+    with open(basepath + ".meta.json", "w") as f:
+        json.dump({"n_neighbors": int(n_neighbors)}, f)
+    legacy = [basepath + ".json", basepath + ".joblib"]
+    for path in [*legacy, *glob(basepath + ".*.bin")]:
+        if op.exists(path):
+            os.remove(path)
+
+
+def read_version(save_path: str) -> Optional[str]:
+    """Current embedding version, None if embeddings are not versioned"""
+    try:
+        with open(op.join(save_path, EMBEDDING_POINTER)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_version_path(save_path: str) -> str:
+    """Directory of the current embedding version, ``save_path`` if not versioned"""
+    version = read_version(save_path)
+    return op.join(save_path, version) if version else save_path
+
+
+def publish_version(save_path: str, version: str, editions: list, keep: int = 2):
+    """
+    Make ``{save_path}/{version}`` the current embedding version
+    by replacing the pointer file atomically, the backend reloads it
+    without restart. Editions of the previous version that are not in
+    ``editions`` are linked to the new version so that they are still served.
+
+    Only the ``keep`` most recent published versions up to the previous current
+    version are kept. Unpublished versions older than it are left over by
+    runs that were killed and are removed, newer ones may be runs in progress.
+    """
+    version_path = op.join(save_path, version)
+    previous_version = read_version(save_path)
+    previous_path = current_version_path(save_path)
+    for path in glob(op.join(previous_path, "agenda-*")):
+        name = op.basename(path)
+        if name.split(".")[0][len("agenda-") :] in editions:
+            continue
+        if name.endswith(".joblib"):  # legacy nearest neighbors models
+            continue
+        target = op.join(version_path, name)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+    open(op.join(version_path, PUBLISHED_MARKER), "w").close()
+    with open(op.join(save_path, EMBEDDING_POINTER + ".tmp"), "w") as f:
+        f.write(version)
+    os.replace(
+        op.join(save_path, EMBEDDING_POINTER + ".tmp"),
+        op.join(save_path, EMBEDDING_POINTER),
+    )
+
+    if previous_version is None:
+        return
+    # version names are timestamps, oldest first
+    old_versions = sorted(
+        v
+        for v in os.listdir(save_path)
+        if v.startswith("v") and v <= previous_version and v != version
+    )
+    published = [
+        v for v in old_versions if op.exists(op.join(save_path, v, PUBLISHED_MARKER))
+    ]
+    removed = [v for v in old_versions if v not in published]
+    removed += published[: max(len(published) - keep, 0)]
+    for old_version in removed:
+        shutil.rmtree(op.join(save_path, old_version))
+
+
+def build_ann_index(
+    basepath: str,
+    X: np.ndarray,
+    ann: str = "hnsw",
+    M: int = 16,
+    ef_construction: int = 200,
+):
+    """
+    Build an approximate nearest neighbors index of embeddings ``X``
+    where labels are row numbers, and save to ``{basepath}.{ann}.bin``.
+    The backend loads it with ``utils.ann_utils.load_ann_index``.
+
+    ann: str, ANN backend, only ``hnsw`` for now
+    M: int, number of links per node in the HNSW graph
+    ef_construction: int, size of the candidate list while building the graph
+    """
+    assert ann in ["hnsw"]
+    import hnswlib
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    index = hnswlib.Index(space="l2", dim=X.shape[1])
+    index.init_index(max_elements=len(X), ef_construction=ef_construction, M=M)
+    index.add_items(X, np.arange(len(X)))
+    index.save_index(f"{basepath}.{ann}.bin")
+
+
 if __name__ == "__main__":
     arguments = docopt(__doc__, version="0.1")
     save_path = op.join("..", "sitedata", "embeddings")
-    # create embeddings
-    if not op.exists(save_path):
-        os.makedirs(save_path)
+    # write embeddings to a new version, published once all editions are saved
+    version = time.strftime("v%Y%m%d%H%M%S")
+    version_path = op.join(save_path, version)
 
     with open("es_config.yml") as f:
         es_config = yaml.load(f, Loader=yaml.FullLoader)
@@ -143,51 +504,111 @@ if __name__ == "__main__":
         n_components = 30
     n_components = int(n_components)
 
-    for k, v in tqdm(es_config["editions"].items()):
-        print(f"Calculate embeddings for edition {k}\n")
-        basename = f"agenda-{k}"
-        path = v.get("path", "")
-        if path.lower().endswith(".json"):
-            df = pd.read_json(path).fillna("")
-        elif path.lower().endswith(".csv"):
-            df = pd.read_csv(path).fillna("")
-        elif v.get("airtable_id") is not None:
-            # if filter_accepted, only filter accepted submissions
-            filter_accepted = v.get("filter_accepted", False)
-            submissions = Table(airtable_key, v["airtable_id"], v["table_name"]).all()
-            submissions = read_submissions(
-                submissions, keys=keys_airtable, filter_accepted=filter_accepted
-            )
-            df = pd.DataFrame(submissions).fillna("")
-        else:
-            df = pd.read_csv(path).fillna("")
+    # SPECTER inference options
+    n_threads = arguments.get("--threads")
+    if n_threads is not None:
+        n_threads = int(n_threads)
+    max_tokens = int(arguments["--max_tokens"])
+    quantize = arguments.get("--quantize", False)
 
-        # number of recommendation
-        n_recommend = arguments.get("--n_recommend")
-        if n_recommend is None:
-            n_recommend = len(df)
-        n_recommend = min(int(n_recommend), len(df))
+    # SPECTER embeddings of unchanged submissions are reused between runs,
+    # int8 embeddings are cached apart from float32 embeddings
+    model_name = SPECTER_MODEL + ("-int8" if quantize else "")
+    cache = EmbeddingCache(op.join(save_path, "cache"), model_name)
+    if arguments.get("--no_cache"):
+        cache.clear()
 
-        # calculate embeddings, save in JSON with the same basename
+    # read all editions first so that their embeddings can be computed together
+    n_workers = int(arguments["--workers"])
+    editions = {}
+    for k, v in es_config["editions"].items():
+        df = read_edition(v)
         if len(df) > 0 and v.get("index", True):
-            paper_embeddings = calculate_embeddings(
-                df, option=option, n_components=n_components
+            editions[k] = df
+        elif not v.get("index", True):
+            print(
+                f"Index is set to False, we will not calculate the embeddings for edition {k}."
             )
-            json.dump(
-                paper_embeddings,
-                open(op.join(save_path, basename + ".json"), "w"),
-                indent=2,
+        else:
+            print(f"Length of dataframe of edition {k} is 0, please recheck the data.")
+
+    # with workers, encode submissions missing from the SPECTER cache in parallel
+    # shards or compute LSA of editions in parallel, then save in this process.
+    # Editions smaller than n_components use SPECTER, see calculate_embeddings
+    lsa_editions = {}
+    if option == "lsa":
+        lsa_editions = {k: df for k, df in editions.items() if len(df) >= n_components}
+    specter_editions = {k: df for k, df in editions.items() if k not in lsa_editions}
+    lsa_embeddings = {}
+    if n_workers > 1 and len(specter_editions) > 0:
+        texts = [t for df in specter_editions.values() for t in specter_texts(df)]
+        missing = list(dict.fromkeys(t for t in texts if cache.get(t) is None))
+        print(f"Encode {len(missing)}/{len(texts)} papers with {n_workers} workers")
+        if len(missing) > 0:
+            X = encode_specter_parallel(
+                missing,
+                n_workers,
+                n_threads=n_threads,
+                quantize=quantize,
+                max_tokens=max_tokens,
             )
+            for paper, emb in zip(missing, X):
+                cache.set(paper, emb)
+            cache.save()
+    if n_workers > 1 and len(lsa_editions) > 0:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                k: executor.submit(
+                    calculate_embeddings, df, option=option, n_components=n_components
+                )
+                for k, df in lsa_editions.items()
+            }
+            lsa_embeddings = {k: future.result() for k, future in futures.items()}
 
-            # nearest neighbors, save in joblib with the same basename
-            X = np.vstack([p["embedding"] for p in paper_embeddings])
-            nbrs_model = NearestNeighbors(n_neighbors=n_recommend).fit(X)
-            joblib.dump(nbrs_model, op.join(save_path, basename + ".joblib"))
-            print(f"Saved embeddings and nearest neighbor model for edition {k}")
-        else:
-            if not v.get("index"):
-                print(
-                    f"Index is set to False, we will not calculate the embeddings for edition {k}."
+    os.makedirs(version_path)
+    try:
+        for k, df in tqdm(editions.items()):
+            print(f"Calculate embeddings for edition {k}\n")
+            basename = f"agenda-{k}"
+
+            # number of recommendation
+            n_recommend = arguments.get("--n_recommend")
+            if n_recommend is None:
+                n_recommend = len(df)
+            n_recommend = min(int(n_recommend), len(df))
+
+            # calculate embeddings, save in binary with the same basename
+            paper_embeddings = lsa_embeddings.get(k)
+            if paper_embeddings is None:
+                paper_embeddings = calculate_embeddings(
+                    df,
+                    option=option,
+                    n_components=n_components,
+                    cache=cache,
+                    max_tokens=max_tokens,
+                    n_threads=n_threads,
+                    quantize=quantize,
                 )
-            else:
-                print("Length of dataframe is 0, please recheck the data.")
+                cache.save()
+            X = np.vstack([p["embedding"] for p in paper_embeddings])
+            save_embeddings(
+                op.join(version_path, basename),
+                X,
+                [p["submission_id"] for p in paper_embeddings],
+                n_neighbors=n_recommend,
+            )
+            ann = arguments.get("--ann")
+            if ann is not None:
+                build_ann_index(op.join(version_path, basename), X, ann=ann)
+            print(f"Saved embeddings for edition {k}")
+        publish_version(
+            save_path, version, list(editions), keep=int(arguments["--keep"])
+        )
+    except BaseException:
+        # do not leave an unpublished version behind
+        if read_version(save_path) != version:
+            shutil.rmtree(version_path, ignore_errors=True)
+        raise
+    print(f"Published embeddings {version}, the backend reloads them without restart")
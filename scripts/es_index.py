@@ -1,20 +1,44 @@
 """
 Elasticsearch ingestion
 
+Each index is built as a new version ``{index}_v{timestamp}`` and the alias
+``{index}`` is then moved to it atomically, so the API never sees a missing
+or half-loaded index. Old versions are kept for rollback.
+
 Usage:
-    python elasticsearch.py
+    es_index.py [--delta] [--skip_grid] [--keep=<keep>] [--threads=<threads>] [--chunk_size=<chunk_size>]
+    es_index.py [-h | --help]
+
+Options:
+    -h --help                   Show this screen
+    --delta                     Only upsert changed documents and delete removed ones
+                                by comparing hashes with the manifest of the last run
+    --skip_grid                 Do not index GRID affiliations
+    --keep=<keep>               Number of old index versions to keep [default: 2]
+    --threads=<threads>         Number of threads sending bulk requests [default: 4]
+    --chunk_size=<chunk_size>   Number of documents per bulk request [default: 500]
 """
 import os
+import os.path as op
+import sys
+import time
+import copy
+import json
 import base64
+import hashlib
+from typing import Optional
+from docopt import docopt
 from pytz import timezone
 import yaml
 from tqdm.auto import tqdm
 import numpy as np
 import pandas as pd
-from pyairtable import Table
 from elasticsearch import Elasticsearch, helpers
 from dotenv import load_dotenv
 
+sys.path.append(op.join(op.dirname(op.abspath(__file__)), "..", "backend", "utils"))
+from airtable_gateway import get_table  # rate-limited Airtable client
+
 load_dotenv(dotenv_path="../.env")  # setting all credentials here
 assert os.environ.get(
     "AIRTABLE_KEY"
@@ -26,6 +50,14 @@ with open("es_config.yml") as f:
 
 es = Elasticsearch([{"host": es_config["host"], "port": es_config["port"]}])
 MAGIC_NUMBER = 9
+# the backend drops its cached abstracts when this file changes
+INDEX_STAMP_PATH = op.join("..", "sitedata", ".es_index_stamp")
+# hash of each indexed document from the last run, used by ``--delta``
+MANIFEST_DIR = op.join("..", "sitedata", "es_manifest")
+VERSION_SEPARATOR = "_v"  # versioned index e.g. agenda-2021-4_v20211020120000
+BULK_THREADS = 4  # threads sending bulk requests, set by --threads
+BULK_CHUNK_SIZE = 500  # documents per bulk request, set by --chunk_size
+CSV_CHUNK_SIZE = 10000  # rows read from a CSV file at a time
 
 keys_airtable = [
     "submission_id",
@@ -109,12 +141,15 @@ settings_submission = {
     "mappings": {
         "submission": {
             "properties": {
-                "submission_id": {"type": "text"},
+                "submission_id": {"type": "keyword"},
                 "title": {"type": "text", "analyzer": "edge_ngram_analyzer"},
                 "abstract": {"type": "text", "analyzer": "edge_ngram_analyzer"},
                 "fullname": {"type": "text", "analyzer": "edge_ngram_analyzer"},
                 "talk_format": {"type": "text", "analyzer": "edge_ngram_analyzer"},
                 "institution": {"type": "text", "analyzer": "edge_ngram_analyzer"},
+                # explicit dates so that the API can filter and sort in ElasticSearch
+                "starttime": {"type": "date", "ignore_malformed": True},
+                "endtime": {"type": "date", "ignore_malformed": True},
             }
         }
     },
@@ -176,17 +211,11 @@ def generate_rows(
 ):
     """
     Generate dictionary to ingest to Elasticsearch.
+    Datetimes of rows are expected to be converted by ``convert_times``
     """
     for _, row in enumerate(rows):
         if isinstance(keys, list):
             row = {k: v for k, v in row.items() if k in keys and v is not np.nan}
-        for k in ["starttime", "endtime"]:
-            if row.get(k) is not None or row.get(k) != "":
-                try:
-                    dt = convert_utc(row.get(k))
-                    row[k] = dt.isoformat()
-                except:
-                    pass
         # generate list of URLs
         urls = generate_urls(row)
         if len(urls) > 0:
@@ -198,22 +227,243 @@ def generate_rows(
         yield {"_index": index, "_type": row_type, "_id": row[id], "_source": row}
 
 
-def index_grid():
+def convert_times(df: pd.DataFrame):
     """
-    Index GRID affiliations to elasticsearch index
+    Convert ``starttime`` and ``endtime`` columns to ISO format in UTC at once,
+    naive datetimes are in UTC and values that cannot be parsed are kept
+    """
+    for k in ["starttime", "endtime"]:
+        if k not in df.columns:
+            continue
+        values = df[k].astype(str)
+        try:
+            dt = pd.to_datetime(values, errors="coerce", utc=True, format="mixed")
+        except (TypeError, ValueError):  # pandas < 2.0 has no format="mixed"
+            dt = pd.to_datetime(values, errors="coerce", utc=True)
+        parsed = dt.notna()
+        df[k] = df[k].astype(object)
+        df.loc[parsed, k] = dt[parsed].dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    return df
+
+
+def generate_documents(
+    chunks, index: str, row_type: str, id: str, keys: Optional[list] = None
+):
     """
-    grid_df = pd.read_csv(f"grid-{es_config['grid_version']}/grid.csv").fillna("")
-    affiliations = grid_df.to_dict(orient="records")
+    Generate documents to ingest to Elasticsearch from chunks of DataFrame,
+    e.g. ``pd.read_csv(path, chunksize=CSV_CHUNK_SIZE)``, so that only
+    one chunk is in memory at a time
+    """
+    for df in chunks:
+        df = convert_times(df.fillna(""))
+        yield from generate_rows(
+            df.to_dict(orient="records"),
+            index=index,
+            row_type=row_type,
+            id=id,
+            keys=keys,
+        )
+
+
+def bulk_index(actions, failed_ids: Optional[set] = None):
+    """
+    Send documents with ``helpers.parallel_bulk`` using ``BULK_THREADS`` threads
+    and ``BULK_CHUNK_SIZE`` documents per request, print the throughput
+    and return the number of documents sent without error
+
+    failed_ids: set, if given, IDs of documents that failed are added to it
+    """
+    tic = time.perf_counter()
+    n_documents, n_errors = 0, 0
+    for ok, info in helpers.parallel_bulk(
+        es,
+        actions,
+        thread_count=BULK_THREADS,
+        chunk_size=BULK_CHUNK_SIZE,
+        queue_size=BULK_THREADS,  # bounded, do not read ahead the whole source
+        raise_on_error=False,
+    ):
+        n_documents += 1
+        if not ok:
+            n_errors += 1
+            if failed_ids is not None:
+                failed_ids.add(next(iter(info.values())).get("_id"))
+            if n_errors <= 10:
+                print(f"Failed to index: {info}")
+    elapsed = time.perf_counter() - tic
+    if n_documents > 0:
+        print(
+            f"Sent {n_documents} documents ({n_errors} errors) in {elapsed:.1f}s, "
+            f"{n_documents / max(elapsed, 1e-6):.0f} docs/sec"
+        )
+    return n_documents - n_errors
 
-    es.indices.delete(index=es_config["grid_index"], ignore=[400, 404])
 
-    grid_df = pd.read_csv(f"grid-{es_config['grid_version']}/grid.csv").fillna("")
-    affiliations = grid_df.to_dict(orient="records")
-    es.indices.create(
-        index=es_config["grid_index"], body=settings_affiliation, include_type_name=True
+def hash_document(source: dict):
+    """Hash of a document to detect changes between runs"""
+    return hashlib.sha1(
+        json.dumps(source, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def manifest_path(index: str):
+    return op.join(MANIFEST_DIR, f"{index}.json")
+
+
+def read_manifest(index: str):
+    """Read document ID to hash of a given index, None if there is no manifest"""
+    if not op.exists(manifest_path(index)):
+        return None
+    with open(manifest_path(index)) as f:
+        return json.load(f)
+
+
+def write_manifest(index: str, manifest: dict):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with open(manifest_path(index) + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path(index) + ".tmp", manifest_path(index))
+
+
+def index_versions(index: str):
+    """List versions of a given index from the oldest to the newest"""
+    versions = es.indices.get(index=f"{index}{VERSION_SEPARATOR}*", ignore=[404])
+    return sorted(k for k in versions.keys() if k not in ("error", "status"))
+
+
+def build_index_version(index: str, actions, settings: dict, keep: int = 2):
+    """
+    Build a new version of an index, then atomically point the alias ``index``
+    to it and delete all but the ``keep`` most recent old versions.
+    Return the manifest (document ID to hash) of the new version.
+
+    Refresh and replicas are turned off while loading. The new version is
+    refreshed and warmed with a search before the swap. A concrete index named
+    ``index`` from before aliases is removed in the same atomic operation.
+    """
+    version = f"{index}{VERSION_SEPARATOR}{time.strftime('%Y%m%d%H%M%S')}"
+    body = copy.deepcopy(settings)
+    body["settings"]["index"].update(
+        {"refresh_interval": "-1", "number_of_replicas": 0}
     )
-    helpers.bulk(es, generate_rows(affiliations, row_type="affiliation", id="ID"))
-    print("Done indexing GRID affiliations")
+    es.indices.create(index=version, body=body, include_type_name=True)
+
+    manifest = {}
+
+    def hashed(actions):
+        for a in actions:
+            manifest[a["_id"]] = hash_document(a["_source"])
+            yield {**a, "_index": version}
+
+    bulk_index(hashed(actions))
+    es.indices.put_settings(  # back to the defaults
+        index=version,
+        body={"index": {"refresh_interval": None, "number_of_replicas": None}},
+    )
+    es.indices.refresh(index=version)
+    n_documents = es.count(index=version)["count"]
+    n_expected = len(manifest)
+    if n_documents != n_expected:
+        es.indices.delete(index=version, ignore=[404])
+        raise RuntimeError(
+            f"Indexed {n_documents}/{n_expected} documents to {version}, "
+            f"keep the alias {index} on the current version"
+        )
+    es.search(index=version, body={"query": {"match_all": {}}, "size": 10})  # warm
+
+    swap = [{"add": {"index": version, "alias": index}}]
+    if es.indices.exists_alias(name=index):
+        for current in es.indices.get_alias(name=index).keys():
+            swap.append({"remove": {"index": current, "alias": index}})
+    elif es.indices.exists(index=index):
+        swap.append({"remove_index": {"index": index}})
+    es.indices.update_aliases(body={"actions": swap})
+
+    old_versions = [v for v in index_versions(index) if v != version]
+    for old_version in old_versions[: max(len(old_versions) - keep, 0)]:
+        es.indices.delete(index=old_version, ignore=[404])
+    return manifest
+
+
+def index_documents(
+    index: str, actions, settings: dict, delta: bool = False, keep: int = 2
+):
+    """
+    Index documents generated by ``generate_documents`` to a given index (alias),
+    documents are streamed and only their hashes are kept in memory
+
+    If ``delta`` is True and the manifest of the last run matches the index
+    (which exists), only upsert documents whose hash changed and delete documents that are gone.
+    Otherwise, build a new version of the index with all documents and swap
+    the alias, see ``build_index_version``.
+    Return the number of indexed and deleted documents.
+    """
+    previous = read_manifest(index) if delta else None
+    if previous is not None and not es.indices.exists(index=index):
+        # upserts would create the index without its mappings, build it instead
+        previous = None
+    elif previous is not None and es.count(index=index)["count"] != len(previous):
+        # the index may have been changed by someone else, fall back to full
+        previous = None
+    if previous is None:
+        manifest = build_index_version(index, actions, settings, keep=keep)
+        write_manifest(index, manifest)
+        return len(manifest), 0
+
+    manifest = {}
+
+    def changed(actions):
+        for a in actions:
+            manifest[a["_id"]] = hash_document(a["_source"])
+            if previous.get(a["_id"]) != manifest[a["_id"]]:
+                yield a
+
+    failed_ids = set()
+    n_indexed = bulk_index(changed(actions), failed_ids=failed_ids)
+    row_type = next(iter(settings["mappings"]))  # e.g. "submission"
+    deleted = [
+        {"_op_type": "delete", "_index": index, "_type": row_type, "_id": doc_id}
+        for doc_id in previous.keys() - manifest.keys()
+    ]
+    n_deleted = bulk_index(deleted, failed_ids=failed_ids)
+    if n_indexed + n_deleted > 0:
+        es.indices.refresh(index=index)
+    # keep the previous hash of failed documents so that the next run retries them
+    for doc_id in failed_ids:
+        if doc_id in previous:
+            manifest[doc_id] = previous[doc_id]
+        else:
+            manifest.pop(doc_id, None)
+    write_manifest(index, manifest)
+    return n_indexed, n_deleted
+
+
+def index_grid(delta: bool = False, keep: int = 2):
+    """
+    Index GRID affiliations to elasticsearch index
+    """
+    grid_chunks = pd.read_csv(
+        f"grid-{es_config['grid_version']}/grid.csv", chunksize=CSV_CHUNK_SIZE
+    )
+    n_indexed, n_deleted = index_documents(
+        es_config["grid_index"],
+        generate_documents(
+            grid_chunks, index=es_config["grid_index"], row_type="affiliation", id="ID"
+        ),
+        settings_affiliation,
+        delta=delta,
+        keep=keep,
+    )
+    print(f"Done indexing GRID affiliations ({n_indexed} indexed, {n_deleted} deleted)")
+
+
+def touch_index_stamp():
+    """
+    Mark that submissions are reindexed so that running
+    backend workers invalidate their abstract caches
+    """
+    with open(INDEX_STAMP_PATH, "w") as f:
+        f.write(str(time.time()))
 
 
 def read_submissions(
@@ -240,10 +490,14 @@ def read_submissions(
     return submissions_flatten
 
 
-def index_submissions():
+def index_submissions(delta: bool = False, keep: int = 2):
     """
     Index all submissions listed in a ``es_config.yml`` file
+
+    delta: bool, if True, only index changed submissions, see ``index_documents``
+    keep: int, number of old versions of each index to keep for rollback
     """
+    n_changes = 0
     for edition, v in tqdm(es_config["editions"].items()):
         if "path" in v.keys():
             submission_df = pd.read_csv(v["path"]).fillna("")
@@ -251,7 +505,9 @@ def index_submissions():
         elif "airtable_id" in v.keys():
             # check if filter accepted key is available
             filter_accepted = v.get("filter_accepted", False)
-            submissions = Table(airtable_key, v["airtable_id"], v["table_name"]).all()
+            submissions = get_table(
+                airtable_key, v["airtable_id"], v["table_name"]
+            ).all()
             submissions = read_submissions(
                 submissions, keys=keys_airtable, filter_accepted=filter_accepted
             )
@@ -263,30 +519,44 @@ def index_submissions():
             raise RuntimeError(
                 "Please put the path to CSV file or Airtable ID in es_config.yml"
             )
-        es.indices.delete(index=v["paper_index"], ignore=[400, 404])
-        es.indices.create(
-            index=v["paper_index"], body=settings_submission, include_type_name=True
-        )
         # if no index, set as True
         if len(submissions) > 0 and v.get("index", True):
             submission_df = pd.DataFrame(submissions)
             submission_df["edition"] = edition
-            submissions = submission_df.to_dict(orient="records")
-            helpers.bulk(
-                es,
-                generate_rows(
-                    submissions,
+            n_indexed, n_deleted = index_documents(
+                v["paper_index"],
+                generate_documents(
+                    [submission_df],
                     index=v["paper_index"],
                     row_type="submission",
                     id="submission_id",
                     keys=keys_airtable,
                 ),
+                settings_submission,
+                delta=delta,
+                keep=keep,
+            )
+            n_changes += n_indexed + n_deleted
+            print(
+                f"Done indexing submissions to {v['paper_index']} "
+                f"({n_indexed} indexed, {n_deleted} deleted)"
             )
-            print(f'Done indexing {len(submissions)} submissions to {v["paper_index"]}')
         else:
+            n_indexed, n_deleted = index_documents(
+                v["paper_index"], [], settings_submission, delta=delta, keep=keep
+            )
+            n_changes += n_indexed + n_deleted
             print(f'Skip indexing submissions to {v["paper_index"]}')
+    if n_changes > 0 or not delta:
+        touch_index_stamp()
 
 
 if __name__ == "__main__":
-    index_grid()  # index GRID database
-    index_submissions()  # index submissions
+    arguments = docopt(__doc__)
+    delta = arguments["--delta"]
+    keep = int(arguments["--keep"])
+    BULK_THREADS = int(arguments["--threads"])
+    BULK_CHUNK_SIZE = int(arguments["--chunk_size"])
+    if not arguments["--skip_grid"]:
+        index_grid(delta=delta, keep=keep)  # index GRID database
+    index_submissions(delta=delta, keep=keep)  # index submissions
@@ -0,0 +1,66 @@
+"""
+Load test the backend with concurrent clients, reports throughput and latency
+
+Usage:
+    load_test.py [--url=<url>] [--clients=<clients>] [--requests=<requests>] [--token=<token>]
+    load_test.py [-h | --help]
+
+Options:
+    -h --help                   Show this screen
+    --url=<url>                 Comma separated endpoints to request in turn
+                                [default: http://localhost:8000/api/abstract/2020-3?view=recommendations]
+    --clients=<clients>         Number of concurrent clients [default: 100]
+    --requests=<requests>       Number of requests per client [default: 20]
+    --token=<token>             Firebase ID token sent as Authorization header
+"""
+
+import time
+import threading
+import urllib.request
+from docopt import docopt
+
+import numpy as np
+
+
+def client(urls: list, n_requests: int, token: str, latencies: list, errors: list):
+    """Send ``n_requests`` requests in sequence, cycling through ``urls``"""
+    headers = {"Authorization": token} if token else {}
+    for i in range(n_requests):
+        request = urllib.request.Request(urls[i % len(urls)], headers=headers)
+        tic = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+            latencies.append(time.perf_counter() - tic)
+        except Exception as e:
+            errors.append(e)
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    urls = arguments["--url"].split(",")
+    n_clients = int(arguments["--clients"])
+    n_requests = int(arguments["--requests"])
+
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(urls, n_requests, arguments["--token"], latencies, errors),
+        )
+        for _ in range(n_clients)
+    ]
+    tic = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - tic
+
+    print(f"{n_clients} clients, {len(latencies)} ok, {len(errors)} errors")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} requests/sec")
+    if len(latencies) > 0:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"Latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    if len(errors) > 0:
+        print(f"First error: {errors[0]}")